@@ -1,14 +1,31 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
+from typing import Literal
 import json
+import threading
 from dotenv import load_dotenv
 from datetime import datetime
-from market import get_share_price
-from database import write_account, read_account, write_log
+from market import get_share_price, get_share_prices
+from database import write_account, read_account, read_account_version, write_log, reset_account, write_trades, read_transactions, read_transaction_count, read_recent_transactions, write_portfolio_value, read_portfolio_values, VersionConflict
+from ledger import Position, replay
 
 load_dotenv(override=True)
 
 INITIAL_BALANCE = 10_000.0
 SPREAD = 0.002
+# How many times a change is re-applied when other processes keep updating the account first
+MAX_COMMIT_ATTEMPTS = 20
+
+commit_stats = {"commits": 0, "conflicts": 0}
+
+# Budget for the compact account summary put into prompts, estimated at CHARS_PER_TOKEN characters a token
+SUMMARY_MAX_TOKENS = 1_500
+SUMMARY_RECENT_TRANSACTIONS = 10
+SUMMARY_RATIONALE_CHARS = 80
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return -(-len(text) // CHARS_PER_TOKEN)
 
 
 class Transaction(BaseModel):
@@ -25,118 +42,304 @@ class Transaction(BaseModel):
         return f"{abs(self.quantity)} shares of {self.symbol} at {self.price} each."
 
 
+class Order(BaseModel):
+    symbol: str
+    side: Literal["buy", "sell"]
+    quantity: int
+    rationale: str
+
+
 class Account(BaseModel):
     name: str
     balance: float
     strategy: str
     holdings: dict[str, int]
-    transactions: list[Transaction]
-    portfolio_value_time_series: list[tuple[str, float]]
+    # Running aggregates, updated with every trade so P&L never rescans the transactions
+    positions: dict[str, Position] = {}
+    net_invested: float = 0.0
+    realized_pnl: float = 0.0
+    # Loaded from its own table on first access, so a balance check never reads the history
+    _transactions: list[Transaction] | None = PrivateAttr(default=None)
+    # Version of the stored account this object reflects, -1 once it may be out of date
+    _version: int = PrivateAttr(default=0)
 
     @classmethod
     def get(cls, name: str):
         fields = read_account(name.lower())
-        if not fields:
+        if fields:
+            version = fields.pop("version")
+        else:
             fields = {
                 "name": name.lower(),
                 "balance": INITIAL_BALANCE,
                 "strategy": "",
                 "holdings": {},
-                "transactions": [],
-                "portfolio_value_time_series": []
+                "positions": {},
+                "net_invested": 0.0,
+                "realized_pnl": 0.0,
             }
-            write_account(name, fields)
-        return cls(**fields)
-    
-    
+            try:
+                # Only the process that inserts the row writes it; a concurrent creator reads theirs
+                version = write_account(name, fields, 0)
+            except VersionConflict:
+                return cls.get(name)
+        account = cls(**fields)
+        account._version = version
+        return account
+
+    @property
+    def transactions(self) -> list[Transaction]:
+        if self._transactions is None:
+            self._transactions = [Transaction(**row) for row in read_transactions(self.name)]
+        return self._transactions
+
+    @property
+    def portfolio_value_time_series(self) -> list[tuple[str, float]]:
+        """ The portfolio value history, downsampled to a bounded number of points. """
+        return read_portfolio_values(self.name)
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def refresh(self):
+        """ Reload this account from the DB, dropping any changes not yet saved. """
+        fresh = Account.get(self.name)
+        for field in type(self).model_fields:
+            setattr(self, field, getattr(fresh, field))
+        self._transactions = None
+        self._version = fresh._version
+
     def save(self):
-        write_account(self.name.lower(), self.model_dump())
+        """ Write this account unless it changed in the DB since it was read; then raise VersionConflict. """
+        try:
+            self._version = write_account(self.name.lower(), self.model_dump(), self._version)
+        except Exception:
+            self._version = -1
+            raise
+
+    def commit(self, mutate) -> list[Transaction]:
+        """
+        Apply `mutate` to this account and save the result with a compare-and-swap on the version.
+        If another process wrote first, reload the account and apply `mutate` again, so no update
+        is lost and no lock is held while deciding. `mutate` must only change this object (fetch
+        prices beforehand) and returns the transactions it applied, if any.
+        """
+        for _ in range(MAX_COMMIT_ATTEMPTS):
+            if self._version < 0:
+                self.refresh()
+            transactions = mutate() or []
+            try:
+                if transactions:
+                    self.record_transactions(transactions)
+                else:
+                    self.save()
+            except VersionConflict:
+                commit_stats["conflicts"] += 1
+                continue
+            commit_stats["commits"] += 1
+            return transactions
+        raise RuntimeError(f"Could not update account {self.name}, it kept changing concurrently")
+
+    def apply_transaction(self, transaction: Transaction):
+        """ Apply a trade to the holdings and running aggregates; the balance is updated by the caller. """
+        held = self.holdings.get(transaction.symbol, 0)
+        position = self.positions.setdefault(transaction.symbol, Position())
+        self.realized_pnl += position.apply(held, transaction.quantity, transaction.price)
+        self.net_invested += transaction.total()
+        if held + transaction.quantity:
+            self.holdings[transaction.symbol] = held + transaction.quantity
+        else:
+            del self.holdings[transaction.symbol]
+
+    def record_transactions(self, transactions: list[Transaction]):
+        """
+        Persist applied transactions together with the new balance, holdings and aggregates,
+        with the same compare-and-swap as save().
+        """
+        try:
+            self._version = write_trades(self.name, self.model_dump(), [transaction.model_dump() for transaction in transactions], self._version)
+        except Exception:
+            self._version = -1
+            raise
+        if self._transactions is not None:
+            self._transactions.extend(transactions)
+
+    def record_portfolio_value(self, portfolio_value: float):
+        write_portfolio_value(self.name, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), portfolio_value)
 
     def reset(self, strategy: str):
         self.balance = INITIAL_BALANCE
         self.strategy = strategy
         self.holdings = {}
-        self.transactions = []
-        self.portfolio_value_time_series = []
-        self.save()
+        self.positions = {}
+        self.net_invested = 0.0
+        self.realized_pnl = 0.0
+        self._transactions = []
+        self._version = reset_account(self.name, self.balance, self.strategy)
 
     def deposit(self, amount: float):
         """ Deposit funds into the account. """
         if amount <= 0:
             raise ValueError("Deposit amount must be positive.")
-        self.balance += amount
+
+        def mutate():
+            self.balance += amount
+
+        self.commit(mutate)
         print(f"Deposited ${amount}. New balance: ${self.balance}")
-        self.save()
 
     def withdraw(self, amount: float):
         """ Withdraw funds from the account, ensuring it doesn't go negative. """
-        if amount > self.balance:
-            raise ValueError("Insufficient funds for withdrawal.")
-        self.balance -= amount
+        def mutate():
+            if amount > self.balance:
+                raise ValueError("Insufficient funds for withdrawal.")
+            self.balance -= amount
+
+        self.commit(mutate)
         print(f"Withdrew ${amount}. New balance: ${self.balance}")
-        self.save()
 
     def buy_shares(self, symbol: str, quantity: int, rationale: str) -> str:
         """ Buy shares of a stock if sufficient funds are available. """
         price = get_share_price(symbol)
         buy_price = price * (1 + SPREAD)
         total_cost = buy_price * quantity
-        
-        if total_cost > self.balance:
-            raise ValueError("Insufficient funds to buy shares.")
-        elif price==0:
-            raise ValueError(f"Unrecognized symbol {symbol}")
-        
-        # Update holdings
-        self.holdings[symbol] = self.holdings.get(symbol, 0) + quantity
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        # Record transaction
-        transaction = Transaction(symbol=symbol, quantity=quantity, price=buy_price, timestamp=timestamp, rationale=rationale)
-        self.transactions.append(transaction)
-        
-        # Update balance
-        self.balance -= total_cost
-        self.save()
+
+        def mutate():
+            if total_cost > self.balance:
+                raise ValueError("Insufficient funds to buy shares.")
+            elif price==0:
+                raise ValueError(f"Unrecognized symbol {symbol}")
+
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            # Record transaction and update holdings
+            transaction = Transaction(symbol=symbol, quantity=quantity, price=buy_price, timestamp=timestamp, rationale=rationale)
+            self.apply_transaction(transaction)
+
+            # Update balance
+            self.balance -= total_cost
+            return [transaction]
+
+        transactions = self.commit(mutate)
         write_log(self.name, "account", f"Bought {quantity} of {symbol}")
-        return "Completed. Latest details:\n" + self.report()
+        return self.trade_result(transactions)
 
     def sell_shares(self, symbol: str, quantity: int, rationale: str) -> str:
         """ Sell shares of a stock if the user has enough shares. """
         if self.holdings.get(symbol, 0) < quantity:
             raise ValueError(f"Cannot sell {quantity} shares of {symbol}. Not enough shares held.")
-        
+
         price = get_share_price(symbol)
         sell_price = price * (1 - SPREAD)
         total_proceeds = sell_price * quantity
-        
-        # Update holdings
-        self.holdings[symbol] -= quantity
-        
-        # If shares are completely sold, remove from holdings
-        if self.holdings[symbol] == 0:
-            del self.holdings[symbol]
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        # Record transaction
-        transaction = Transaction(symbol=symbol, quantity=-quantity, price=sell_price, timestamp=timestamp, rationale=rationale)  # negative quantity for sell
-        self.transactions.append(transaction)
-
-        # Update balance
-        self.balance += total_proceeds
-        self.save()
+
+        def mutate():
+            if self.holdings.get(symbol, 0) < quantity:
+                raise ValueError(f"Cannot sell {quantity} shares of {symbol}. Not enough shares held.")
+
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            # Record transaction and update holdings, removing the symbol once completely sold
+            transaction = Transaction(symbol=symbol, quantity=-quantity, price=sell_price, timestamp=timestamp, rationale=rationale)  # negative quantity for sell
+            self.apply_transaction(transaction)
+
+            # Update balance
+            self.balance += total_proceeds
+            return [transaction]
+
+        transactions = self.commit(mutate)
         write_log(self.name, "account", f"Sold {quantity} of {symbol}")
-        return "Completed. Latest details:\n" + self.report()
+        return self.trade_result(transactions)
+
+    def execute_orders(self, orders: list[Order]) -> str:
+        """
+        Execute several buys and sells together: either all of them or none.
+        Sells are applied before buys, so their proceeds can pay for the buys.
+        """
+        if not orders:
+            raise ValueError("No orders given.")
+        for order in orders:
+            if order.quantity <= 0:
+                raise ValueError(f"Quantity for {order.symbol} must be positive.")
+
+        prices = get_share_prices(list(dict.fromkeys(order.symbol for order in orders)))
+        unknown = [symbol for symbol, price in prices.items() if price == 0]
+        if unknown:
+            raise ValueError(f"Unrecognized symbols {', '.join(unknown)}")
+        ordered = sorted(orders, key=lambda order: order.side != "sell")
+
+        def mutate():
+            selling = {}
+            for order in ordered:
+                if order.side == "sell":
+                    selling[order.symbol] = selling.get(order.symbol, 0) + order.quantity
+            for symbol, quantity in selling.items():
+                if self.holdings.get(symbol, 0) < quantity:
+                    raise ValueError(f"Cannot sell {quantity} shares of {symbol}. Not enough shares held.")
+
+            spread = {"buy": 1 + SPREAD, "sell": 1 - SPREAD}
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            transactions = [
+                Transaction(symbol=order.symbol, quantity=order.quantity if order.side == "buy" else -order.quantity,
+                            price=prices[order.symbol] * spread[order.side], timestamp=timestamp, rationale=order.rationale)
+                for order in ordered
+            ]
+            cost = sum(transaction.total() for transaction in transactions)
+            if cost > self.balance:
+                raise ValueError("Insufficient funds to buy shares.")
+
+            for transaction in transactions:
+                self.apply_transaction(transaction)
+            self.balance -= cost
+            return transactions
+
+        transactions = self.commit(mutate)
+        summary = ", ".join(f"{'Bought' if t.quantity > 0 else 'Sold'} {abs(t.quantity)} of {t.symbol}" for t in transactions)
+        write_log(self.name, "account", summary)
+        return self.trade_result(transactions)
+
+    def trade_result(self, transactions: list[Transaction]) -> str:
+        """ What the trade tools return: the trades just made, which the summary may leave out, then the summary. """
+        made = "; ".join(f"{'Bought' if t.quantity > 0 else 'Sold'} {abs(t.quantity)} of {t.symbol} at {t.price:.2f}" for t in transactions)
+        return f"Completed: {made}. Latest details:\n" + self.summary()
 
     def calculate_portfolio_value(self):
         """ Calculate the total value of the user's portfolio. """
         total_value = self.balance
+        prices = get_share_prices(list(self.holdings))
         for symbol, quantity in self.holdings.items():
-            total_value += get_share_price(symbol) * quantity
+            total_value += prices[symbol] * quantity
         return total_value
 
     def calculate_profit_loss(self, portfolio_value: float):
         """ Calculate profit or loss from the initial spend. """
-        initial_spend = sum(transaction.total() for transaction in self.transactions)
-        return portfolio_value - initial_spend - self.balance
+        return portfolio_value - self.net_invested - self.balance
+
+    def verify_aggregates(self) -> list[str]:
+        """ Recompute holdings and aggregates from the full transaction history and list any mismatches. """
+        holdings, positions = replay((t.symbol, t.quantity, t.price) for t in self.transactions)
+        problems = []
+        if holdings != self.holdings:
+            problems.append(f"holdings are {self.holdings}, transactions give {holdings}")
+        for symbol in positions.keys() | self.positions.keys():
+            expected = positions.get(symbol, Position()).model_dump()
+            actual = self.positions.get(symbol, Position()).model_dump()
+            for field, value in expected.items():
+                if abs(actual[field] - value) > 1e-6:
+                    problems.append(f"{symbol} {field} is {actual[field]}, transactions give {value}")
+        for field, value in (("net_invested", sum(p.net_invested for p in positions.values())),
+                             ("realized_pnl", sum(p.realized_pnl for p in positions.values()))):
+            if abs(getattr(self, field) - value) > 1e-6:
+                problems.append(f"{field} is {getattr(self, field)}, transactions give {value}")
+        return problems
+
+    def rebuild_aggregates(self):
+        """ Replace the running aggregates with values recomputed from the transactions. """
+        def mutate():
+            self.holdings, self.positions = replay((t.symbol, t.quantity, t.price) for t in self.transactions)
+            self.net_invested = sum(p.net_invested for p in self.positions.values())
+            self.realized_pnl = sum(p.realized_pnl for p in self.positions.values())
+
+        self.commit(mutate)
 
     def get_holdings(self):
         """ Report the current holdings of the user. """
@@ -153,15 +356,77 @@ class Account(BaseModel):
     def report(self) -> str:
         """ Return a json string representing the account.  """
         portfolio_value = self.calculate_portfolio_value()
-        self.portfolio_value_time_series.append((datetime.now().strftime("%Y-%m-%d %H:%M:%S"), portfolio_value))
-        self.save()
+        self.record_portfolio_value(portfolio_value)
         pnl = self.calculate_profit_loss(portfolio_value)
         data = self.model_dump()
+        data["transactions"] = self.list_transactions()
+        data["portfolio_value_time_series"] = self.portfolio_value_time_series
         data["total_portfolio_value"] = portfolio_value
         data["total_profit_loss"] = pnl
         write_log(self.name, "account", f"Retrieved account details")
         return json.dumps(data)
     
+    def summary(self, max_tokens: int = SUMMARY_MAX_TOKENS, recent: int = SUMMARY_RECENT_TRANSACTIONS) -> str:
+        """
+        Return a compact json summary of the account for prompts: totals, each position with its
+        cost basis and unrealized P&L, and the last few transactions. Unlike report() its size
+        doesn't grow with the history. To stay within `max_tokens` it shortens rationales, then
+        drops the oldest of the recent transactions, then folds the smallest positions together.
+        """
+        prices = get_share_prices(list(self.holdings))
+        positions = {}
+        for symbol, quantity in self.holdings.items():
+            value = prices[symbol] * quantity
+            cost_basis = self.positions[symbol].cost_basis if symbol in self.positions else 0.0
+            positions[symbol] = {
+                "quantity": quantity,
+                "price": round(prices[symbol], 2),
+                "value": round(value, 2),
+                "cost_basis": round(cost_basis, 2),
+                "unrealized_pnl": round(value - cost_basis, 2),
+            }
+        portfolio_value = self.balance + sum(position["value"] for position in positions.values())
+        self.record_portfolio_value(portfolio_value)
+
+        # Only the count and the last few are needed, so the history isn't loaded
+        recent_transactions = [Transaction(**row) for row in read_recent_transactions(self.name, recent)] if recent else []
+        data = {
+            "name": self.name,
+            "balance": round(self.balance, 2),
+            "total_portfolio_value": round(portfolio_value, 2),
+            "total_profit_loss": round(self.calculate_profit_loss(portfolio_value), 2),
+            "realized_pnl": round(self.realized_pnl, 2),
+            "unrealized_pnl": round(sum(position["unrealized_pnl"] for position in positions.values()), 2),
+            "positions": positions,
+            "transaction_count": read_transaction_count(self.name),
+            "recent_transactions": [
+                {"timestamp": t.timestamp, "symbol": t.symbol, "quantity": t.quantity, "price": round(t.price, 2), "rationale": t.rationale}
+                for t in recent_transactions
+            ],
+        }
+
+        def fits() -> bool:
+            return estimate_tokens(json.dumps(data)) <= max_tokens
+
+        if not fits():
+            for transaction in data["recent_transactions"]:
+                if len(transaction["rationale"]) > SUMMARY_RATIONALE_CHARS:
+                    transaction["rationale"] = transaction["rationale"][:SUMMARY_RATIONALE_CHARS] + "..."
+        while not fits() and data["recent_transactions"]:
+            data["recent_transactions"].pop(0)
+        if not fits():
+            by_value = sorted(positions, key=lambda symbol: positions[symbol]["value"])
+            other = {"count": 0, "value": 0.0, "unrealized_pnl": 0.0}
+            data["other_positions"] = other
+            while not fits() and len(positions) > 1:
+                position = positions.pop(by_value.pop(0))
+                other["count"] += 1
+                other["value"] = round(other["value"] + position["value"], 2)
+                other["unrealized_pnl"] = round(other["unrealized_pnl"] + position["unrealized_pnl"], 2)
+
+        write_log(self.name, "account", f"Retrieved account summary")
+        return json.dumps(data)
+
     def get_strategy(self) -> str:
         """ Return the strategy of the account """
         write_log(self.name, "account", f"Retrieved strategy")
@@ -169,11 +434,48 @@ class Account(BaseModel):
     
     def change_strategy(self, strategy: str) -> str:
         """ At your discretion, if you choose to, call this to change your investment strategy for the future """
-        self.strategy = strategy
-        self.save()
+        def mutate():
+            self.strategy = strategy
+
+        self.commit(mutate)
         write_log(self.name, "account", f"Changed strategy")
         return "Changed strategy"
 
+class AccountCache:
+    """
+    Accounts kept in memory between calls, for long-running processes such as the accounts server.
+
+    Before a cached account is returned, its version is compared with the one in the DB, a
+    single indexed lookup. Saves write through the cached object and keep it current, so
+    only writes from other processes cause a reload.
+    """
+
+    def __init__(self):
+        self.accounts: dict[str, Account] = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, name: str) -> Account:
+        name = name.lower()
+        with self.lock:
+            account = self.accounts.get(name)
+            if account is not None and account.version == read_account_version(name):
+                self.hits += 1
+                return account
+            if account is None:
+                self.misses += 1
+            else:
+                self.invalidations += 1
+            account = Account.get(name)
+            self.accounts[name] = account
+            return account
+
+    def stats(self) -> dict[str, int]:
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "invalidations": self.invalidations, "size": len(self.accounts)}
+
 # Example of usage:
 if __name__ == "__main__":
     account = Account("John Doe")
@@ -1,43 +1,205 @@
 import mcp
 from mcp.client.stdio import stdio_client
 from mcp import StdioServerParameters
+from mcp.shared.exceptions import McpError
 from agents import FunctionTool
 
+import asyncio
 import json
+import time
+from contextlib import asynccontextmanager
 
 params = StdioServerParameters(command="uv", args=["run", "accounts_server.py"], env=None)
 
+# Most sessions kept open to the server, and so most calls in flight at once
+POOL_SIZE = 4
+# A session idle for longer than this is pinged before it is reused
+HEALTH_CHECK_AFTER = 30.0
+PING_TIMEOUT = 5.0
+
+
+class PooledSession:
+    """
+    One initialized MCP session with a server subprocess.
+
+    The stdio transport and the session are entered and exited by a task of their own:
+    anyio requires a cancel scope to be exited by the task that entered it, and a pooled
+    session outlives the call that opened it.
+    """
+
+    def __init__(self, server_params: StdioServerParameters):
+        self.server_params = server_params
+        self.session: mcp.ClientSession | None = None
+        self.closing = asyncio.Event()
+        self.task: asyncio.Task | None = None
+        self.last_used = time.monotonic()
+
+    async def open(self) -> None:
+        ready = asyncio.get_running_loop().create_future()
+        self.task = asyncio.create_task(self._run(ready))
+        await ready
+
+    async def _run(self, ready: asyncio.Future) -> None:
+        try:
+            async with stdio_client(self.server_params) as streams:
+                async with mcp.ClientSession(*streams) as session:
+                    await session.initialize()
+                    self.session = session
+                    ready.set_result(None)
+                    await self.closing.wait()
+        except Exception as e:
+            if not ready.done():
+                ready.set_exception(e)
+            else:
+                print(f"MCP session with {' '.join(self.server_params.args)} ended due to {e}")
+        finally:
+            self.session = None
+
+    @property
+    def alive(self) -> bool:
+        return self.session is not None and not self.task.done()
+
+    async def healthy(self) -> bool:
+        if not self.alive:
+            return False
+        try:
+            await asyncio.wait_for(self.session.send_ping(), PING_TIMEOUT)
+            return True
+        except Exception:
+            return False
+
+    async def close(self) -> None:
+        self.closing.set()
+        if self.task:
+            try:
+                await asyncio.wait_for(self.task, PING_TIMEOUT)
+            except Exception:
+                pass
+
+
+class MCPClientPool:
+    """
+    Long-lived client for an MCP server that keeps up to `size` initialized sessions open
+    and reuses them across calls, instead of starting the server for every call.
+
+    A session idle for more than `health_check_after` seconds is pinged before reuse and
+    replaced if the server doesn't answer. Sessions that fail with anything other than an
+    error reply from the server are dropped, and reads are retried once on a new session;
+    tool calls are not retried, as they may have taken effect before the failure. The tool
+    listing is cached, since a server's tools don't change while it runs.
+    """
+
+    def __init__(self, server_params: StdioServerParameters, size: int = POOL_SIZE, health_check_after: float = HEALTH_CHECK_AFTER):
+        self.server_params = server_params
+        self.size = size
+        self.health_check_after = health_check_after
+        self.loop = None
+        self.idle: list[PooledSession] = []
+        self.slots: asyncio.Semaphore | None = None
+        self.tools = None
+        self.opened = 0
+        self.reused = 0
+        self.failed_checks = 0
+        self.dropped = 0
+
+    def _bind(self) -> None:
+        # Sessions belong to the event loop that opened them, so a new loop starts a new pool
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            self.loop = loop
+            self.idle = []
+            self.slots = asyncio.Semaphore(self.size)
+
+    async def _checkout(self) -> PooledSession:
+        while self.idle:
+            pooled = self.idle.pop()
+            if pooled.alive and (time.monotonic() - pooled.last_used < self.health_check_after or await pooled.healthy()):
+                self.reused += 1
+                return pooled
+            self.failed_checks += 1
+            await pooled.close()
+        pooled = PooledSession(self.server_params)
+        await pooled.open()
+        self.opened += 1
+        return pooled
+
+    @asynccontextmanager
+    async def session(self):
+        """ Borrow an initialized session for the duration of the block. """
+        self._bind()
+        async with self.slots:
+            pooled = await self._checkout()
+            try:
+                yield pooled.session
+            except McpError:
+                pooled.last_used = time.monotonic()
+                self.idle.append(pooled)
+                raise
+            except BaseException:
+                self.dropped += 1
+                await pooled.close()
+                raise
+            pooled.last_used = time.monotonic()
+            self.idle.append(pooled)
+
+    async def _read(self, request):
+        try:
+            async with self.session() as session:
+                return await request(session)
+        except McpError:
+            raise
+        except Exception:
+            async with self.session() as session:
+                return await request(session)
+
+    async def list_tools(self):
+        if self.tools is None:
+            self.tools = (await self._read(lambda session: session.list_tools())).tools
+        return self.tools
+
+    async def call_tool(self, tool_name, tool_args):
+        async with self.session() as session:
+            return await session.call_tool(tool_name, tool_args)
+
+    async def read_resource(self, uri: str) -> str:
+        result = await self._read(lambda session: session.read_resource(uri))
+        return result.contents[0].text
+
+    async def close(self) -> None:
+        idle, self.idle = self.idle, []
+        for pooled in idle:
+            await pooled.close()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "opened": self.opened,
+            "reused": self.reused,
+            "failed_checks": self.failed_checks,
+            "dropped": self.dropped,
+            "idle": len(self.idle),
+        }
+
+
+accounts_client = MCPClientPool(params)
+
 async def list_account_tools():
-    async with stdio_client(params) as streams:
-        async with mcp.ClientSession(*streams) as session:
-            await session.initialize()
-            tools_result = await session.list_tools()
-            return tools_result.tools
+    return await accounts_client.list_tools()
 
 async def call_accounts_tool(tool_name, tool_args):
-    async with stdio_client(params) as streams:
-        async with mcp.ClientSession(*streams) as session:
-            await session.initialize()
-            result = await session.call_tool(tool_name, tool_args)
-            return result
+    return await accounts_client.call_tool(tool_name, tool_args)
 
 async def read_accounts_resource(name):
-    async with stdio_client(params) as streams:
-        async with mcp.ClientSession(*streams) as session:
-            await session.initialize()
-            result = await session.read_resource(f'accounts://accounts_server/{name}')
-            return result.contents[0].text
+    return await accounts_client.read_resource(f'accounts://accounts_server/{name}')
+
+async def read_summary_resource(name):
+    return await accounts_client.read_resource(f'accounts://summary/{name}')
 
 async def read_strategy_resource(name):
-    async with stdio_client(params) as streams:
-        async with mcp.ClientSession(*streams) as session:
-            await session.initialize()
-            result = await session.read_resource(f'accounts://strategy/{name}')
-            return result.contents[0].text
+    return await accounts_client.read_resource(f'accounts://strategy/{name}')
 
 async def get_accounts_tools_openai():
     openai_tools = []
-    
+
     for tool in await list_account_tools():
         schema = {**tool.inputSchema, "additionalProperties": False}
         openai_tool = FunctionTool(
@@ -47,5 +209,5 @@ async def get_accounts_tools_openai():
             on_invoke_tool=lambda ctx, args, toolname=tool.name: call_accounts_tool(toolname, json.loads(args))
         )
         openai_tools.append(openai_tool)
-    
-    return openai_tools
\ No newline at end of file
+
+    return openai_tools
@@ -1,50 +1,69 @@
 from mcp.server.fastmcp import FastMCP
-from accounts import Account
+from accounts import AccountCache, Order
+import json
 
 mcp = FastMCP('accounts_server')
+accounts = AccountCache()
 
 @mcp.tool()
 async def get_balance(name: str) -> float:
     """Get the cash balance of the given account name"""
-    return Account.get(name).balance
+    return accounts.get(name).balance
 
 @mcp.tool()
 async def get_holdings(name: str) -> float:
     """Get the holdings of the given account name"""
-    return Account.get(name).holdings
+    return accounts.get(name).holdings
 
 @mcp.tool()
-async def buy_shares(name: str, symbol: str, quantity: int, rationale: str) -> float:
+async def buy_shares(name: str, symbol: str, quantity: int, rationale: str) -> str:
     """Buy shares of a stock.
     Args:
         name: name of the account holder
         symbol: symbol of the stock
         quantity: how many shares to buy
         rationale: reason for purchasing, fit with the account's strategy"""
-    return Account.get(name).buy_shares(symbol, quantity, rationale)
+    return accounts.get(name).buy_shares(symbol, quantity, rationale)
 
 @mcp.tool()
-async def sell_shares(name: str, symbol: str, quantity: int, rationale: str) -> float:
+async def sell_shares(name: str, symbol: str, quantity: int, rationale: str) -> str:
     """Sell shares of a stock.
     Args:
         name: name of the account holder
         symbol: symbol of the stock
         quantity: how many shares to sell
         rationale: reason for selling, fit with the account's strategy"""
-    return Account.get(name).sell_shares(symbol, quantity, rationale)
+    return accounts.get(name).sell_shares(symbol, quantity, rationale)
+
+@mcp.tool()
+async def execute_orders(name: str, orders: list[Order]) -> str:
+    """Buy and sell several stocks at once: all orders are executed together, or none are.
+    Prefer this to separate buy_shares and sell_shares calls when rebalancing.
+    Args:
+        name: name of the account holder
+        orders: the orders, each with the stock symbol, side ("buy" or "sell"), quantity of shares and rationale"""
+    return accounts.get(name).execute_orders(orders)
 
 @mcp.tool()
 async def change_strategy(name: str, strategy: str) -> str:
     """At your discretion, call this to change your investment strategy"""
-    return Account.get(name).change_strategy(strategy)
+    return accounts.get(name).change_strategy(strategy)
 
 @mcp.resource("accounts://accounts_server/{name}")
 async def read_accounts_resource(name: str) -> str:
-    return Account.get(name.lower()).report()
+    return accounts.get(name).report()
+
+@mcp.resource("accounts://summary/{name}")
+async def read_summary_resource(name: str) -> str:
+    return accounts.get(name).summary()
 
 @mcp.resource("accounts://strategy/{name}")
 async def read_strategy_resource(name: str) -> str:
-    return Account.get(name.lower()).get_strategy()
+    return accounts.get(name).get_strategy()
+
+@mcp.resource("accounts://stats")
+async def read_stats_resource() -> str:
+    return json.dumps(accounts.stats())
 
 if __name__ == "__main__":
     mcp.run(transport='stdio')
@@ -2,10 +2,12 @@ import gradio as gr
 import pandas as pd
 import plotly.express as px
 
+from collections import deque
+
 from utils import css, js, Color
 
 from accounts import Account
-from database import read_log
+from database import read_log_since
 
 from trading_floor import names, lastnames, short_model_names
 
@@ -18,12 +20,16 @@ mapper = {
     "account": Color.RED,
 }
 
+LOG_LINES = 13
+
 class Trader:
     def __init__(self, name: str, lastname: str, model_name: str):
         self.name = name
         self.lastname = lastname
         self.model_name = model_name
         self.account = Account.get(name)
+        self.log_cursor = 0
+        self.log_lines = deque(maxlen=LOG_LINES)
     
     def reload(self):
         self.account = Account.get(self.name)
@@ -101,15 +107,14 @@ class Trader:
 """
     
     def get_logs(self, prev=None) -> str:
-        logs = read_log(self.name, last_n=13)
-        response = ''
+        logs = read_log_since(self.name, self.log_cursor, last_n=LOG_LINES)
 
         for log in logs:
-            timestamp, type_, msg = log
+            self.log_cursor, timestamp, type_, msg = log
             color = mapper.get(type_, Color.WHITE).value
-            response += f"<span style='color: {color};'>{timestamp} : [{type_}] {msg}</span> <br/>"
+            self.log_lines.append(f"<span style='color: {color};'>{timestamp} : [{type_}] {msg}</span> <br/>")
         
-        response = f"<div style='height: 250px; overflow-y: auto;'>{response}</div>"
+        response = f"<div style='height: 250px; overflow-y: auto;'>{''.join(self.log_lines)}</div>"
 
         if response != prev:
             return response
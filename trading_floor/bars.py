@@ -0,0 +1,59 @@
+import numpy as np
+from datetime import date, timedelta
+
+from database import read_bars, read_bar_dates, write_bars
+from market import get_grouped_daily_bars
+from market_calendar import MarketCalendar
+
+BAR_FIELDS = ("open", "high", "low", "close", "volume")
+
+
+def ingest_day(day: date) -> int:
+    """ Fetch and store the daily bars of every symbol for one day; return how many were stored. """
+    bars = get_grouped_daily_bars(day)
+    write_bars(bars)
+    return len(bars)
+
+
+def backfill(start: date, end: date) -> int:
+    """ Ingest every trading day between start and end inclusive that has no bars stored yet. """
+    calendar = MarketCalendar()
+    stored = set(read_bar_dates())
+    ingested = 0
+    day = start
+    while day <= end:
+        if calendar.session(day) and str(day) not in stored:
+            ingested += ingest_day(day)
+        day += timedelta(days=1)
+    return ingested
+
+
+def get_bars(symbol: str, start: date | str, end: date | str) -> dict[str, np.ndarray]:
+    """
+    Return the daily bars of a symbol between two dates inclusive as NumPy arrays:
+    "date" (datetime64[D]) and one float64 array per field in BAR_FIELDS, oldest first.
+    """
+    rows = read_bars(symbol, str(start), str(end))
+    dates = np.array([row[0] for row in rows], dtype="datetime64[D]")
+    values = np.array([row[1:] for row in rows], dtype=np.float64).reshape(len(rows), len(BAR_FIELDS))
+    return {"date": dates, **{field: values[:, i] for i, field in enumerate(BAR_FIELDS)}}
+
+
+def get_field_matrix(symbols: list[str], start: date | str, end: date | str, field: str = "close") -> tuple[np.ndarray, np.ndarray]:
+    """
+    Return (dates, matrix) where matrix[i, j] is the given field of symbols[j] on dates[i].
+    Dates are the union of the symbols' bar dates; missing values are NaN.
+    """
+    if field not in BAR_FIELDS:
+        raise ValueError(f"Unknown bar field {field}")
+    series = {}
+    for symbol in symbols:
+        bars = get_bars(symbol, start, end)
+        series[symbol] = (bars["date"], bars[field])
+
+    dates = np.unique(np.concatenate([d for d, _ in series.values()])) if series else np.array([], dtype="datetime64[D]")
+    matrix = np.full((len(dates), len(symbols)), np.nan)
+    for j, symbol in enumerate(symbols):
+        symbol_dates, values = series[symbol]
+        matrix[np.searchsorted(dates, symbol_dates), j] = values
+    return dates, matrix
@@ -0,0 +1,337 @@
+"""
+Micro-benchmarks for the trading floor.
+
+Each benchmark runs against a scratch database in a temporary directory, never accounts.db.
+
+Usage: uv run benchmarks.py [name ...]
+"""
+import os
+import sys
+import sqlite3
+import tempfile
+import time
+
+# Worker processes inherit the scratch directory through the environment so they share its database
+SCRATCH_DIR = os.environ.get("TRADING_FLOOR_BENCH_DIR") or tempfile.mkdtemp(prefix="trading_floor_bench_")
+os.environ["TRADING_FLOOR_BENCH_DIR"] = SCRATCH_DIR
+os.environ["ACCOUNTS_DB"] = os.path.join(SCRATCH_DIR, "accounts.db")
+
+import database  # noqa: E402  (must be imported after ACCOUNTS_DB is set)
+
+
+def report(label: str, ops: int, elapsed: float) -> None:
+    print(f"{label:<40} {ops / elapsed:>12,.0f} ops/sec")
+
+
+def timed(fn, ops: int) -> float:
+    start = time.perf_counter()
+    for i in range(ops):
+        fn(i)
+    return time.perf_counter() - start
+
+
+def bench_account(i: int) -> dict:
+    position = {"cost_basis": 10.0 * i, "realized_pnl": 0.0, "net_invested": 10.0 * i}
+    return {"balance": i, "strategy": "", "holdings": {"AAPL": i}, "positions": {"AAPL": position}, "net_invested": 10.0 * i, "realized_pnl": 0.0}
+
+
+def bench_database(ops: int = 2_000) -> None:
+    """ Connect-per-call in rollback-journal mode (the old helpers) versus the pooled WAL connection. """
+    legacy_db = os.path.join(SCRATCH_DIR, "legacy.db")
+    with sqlite3.connect(legacy_db) as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS accounts (name TEXT PRIMARY KEY, account TEXT)")
+        conn.execute("CREATE TABLE IF NOT EXISTS logs (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, datetime DATETIME, type TEXT, message TEXT)")
+
+    def legacy_write_log(i):
+        with sqlite3.connect(legacy_db) as conn:
+            conn.execute("INSERT INTO logs (name, datetime, type, message) VALUES (?, datetime('now'), ?, ?)", ("bench", "account", f"message {i}"))
+            conn.commit()
+
+    def legacy_write_account(i):
+        with sqlite3.connect(legacy_db) as conn:
+            conn.execute("INSERT INTO accounts (name, account) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET account=excluded.account", ("bench", f'{{"balance": {i}}}'))
+            conn.commit()
+
+    def legacy_read_account(i):
+        with sqlite3.connect(legacy_db) as conn:
+            conn.execute("SELECT account FROM accounts WHERE name = ?", ("bench",)).fetchone()
+
+    print(f"database: {ops} ops each")
+    report("before: write_log", ops, timed(legacy_write_log, ops))
+    elapsed = timed(lambda i: database.write_log("bench", "account", f"message {i}"), ops)
+    start = time.perf_counter()
+    database.flush_logs()
+    report("after:  write_log (incl. flush)", ops, elapsed + time.perf_counter() - start)
+    report("before: write_account", ops, timed(legacy_write_account, ops))
+    report("after:  write_account", ops, timed(lambda i: database.write_account("bench", bench_account(i)), ops))
+    report("before: read_account", ops, timed(legacy_read_account, ops))
+    report("after:  read_account", ops, timed(lambda i: database.read_account("bench"), ops))
+
+
+def bench_polygon_client(ops: int = 300) -> None:
+    """
+    A new RESTClient per call versus the shared client, against a local mock of the Polygon API,
+    then one call to a mock that stalls for longer than the shared client's read timeout.
+    """
+    import json
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MockPolygon(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            time.sleep(self.server.delay)
+            body = json.dumps({"market": "open"}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockPolygon)
+    server.delay = 0.0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["POLYGON_BASE_URL"] = f"http://127.0.0.1:{server.server_port}"
+    os.environ.setdefault("POLYGON_API_KEY", "bench")
+    # Short enough for the stalled call to show the timeout, and no retries so it is hit once
+    os.environ.setdefault("POLYGON_READ_TIMEOUT", "0.5")
+    os.environ.setdefault("POLYGON_RETRIES", "0")
+
+    import market
+    from polygon import RESTClient
+
+    def new_client_per_call(i):
+        RESTClient(market.polygon_api_key, base=market.POLYGON_BASE_URL).get_market_status()
+
+    print(f"polygon client: {ops} market status calls against {market.POLYGON_BASE_URL}")
+    report("before: new RESTClient per call", ops, timed(new_client_per_call, ops))
+    report("after:  shared client", ops, timed(lambda i: market.is_market_open(), ops))
+    print(f"shared client: {market.client_stats()}")
+
+    server.delay = 3.0
+    started = time.perf_counter()
+    try:
+        market.is_market_open()
+        outcome = "answered"
+    except Exception as e:
+        outcome = type(e).__name__
+    print(f"stalled server ({server.delay:.1f}s): {outcome} after {time.perf_counter() - started:.2f}s "
+          f"with read timeout {market.POLYGON_READ_TIMEOUT}s and {market.POLYGON_RETRIES} retries")
+    server.shutdown()
+
+
+def bench_snapshots(ops: int = 200, symbols: int = 10_000) -> None:
+    """ Cold-process price lookup: decoding the JSON snapshot versus binary search over the columnar one. """
+    import json
+    import random
+    import string
+    from snapshots import Snapshot
+
+    market_data = {
+        "".join(random.choices(string.ascii_uppercase, k=random.randint(1, 5))): random.uniform(1, 500)
+        for _ in range(symbols)
+    }
+    probe = next(iter(market_data))
+    snapshot = Snapshot.from_dict(market_data)
+    database.write_market_snapshot("bench", snapshot.symbols, snapshot.prices)
+    with database.transaction() as cursor:
+        cursor.execute("INSERT OR REPLACE INTO market (date, data) VALUES (?, ?)", ("bench", json.dumps(market_data)))
+
+    print(f"snapshots: {ops} cold lookups in a {len(market_data)} symbol snapshot")
+    report("before: read JSON + lookup", ops, timed(lambda i: database.read_market("bench").get(probe), ops))
+    report("after:  read columns + lookup", ops, timed(lambda i: Snapshot(*database.read_market_snapshot("bench")).get(probe), ops))
+
+
+def bench_accounts_client(ops: int = 20) -> None:
+    """ A new accounts server subprocess and MCP handshake per call versus the pooled sessions. """
+    import asyncio
+    import mcp
+    from mcp import StdioServerParameters
+    from mcp.client.stdio import stdio_client
+    from accounts_client import MCPClientPool
+
+    # The scratch ACCOUNTS_DB must reach the server, so pass the whole environment
+    params = StdioServerParameters(command=sys.executable, args=["accounts_server.py"], env=dict(os.environ),
+                                   cwd=os.path.dirname(os.path.abspath(__file__)))
+    uri = "accounts://accounts_server/bench"
+
+    async def read_per_call():
+        async with stdio_client(params) as streams:
+            async with mcp.ClientSession(*streams) as session:
+                await session.initialize()
+                await session.read_resource(uri)
+
+    async def run():
+        pool = MCPClientPool(params)
+        start = time.perf_counter()
+        for _ in range(ops):
+            await read_per_call()
+        report("before: new server per call", ops, time.perf_counter() - start)
+        start = time.perf_counter()
+        for _ in range(ops):
+            await pool.read_resource(uri)
+        report("after:  pooled sessions (incl. startup)", ops, time.perf_counter() - start)
+        start = time.perf_counter()
+        for _ in range(ops):
+            await pool.read_resource(uri)
+        report("after:  pooled sessions (warm)", ops, time.perf_counter() - start)
+        print(f"pool: {pool.stats()}")
+        await pool.close()
+
+    print(f"accounts client: {ops} account reads")
+    asyncio.run(run())
+
+
+def bench_mcp_servers(cycles: int = 5) -> None:
+    """ Starting the market server for every trading cycle versus keeping it running under the supervisor. """
+    import asyncio
+    from agents.mcp import MCPServerStdio
+    from mcp_supervisor import MCPSupervisor
+
+    env = {key: value for key, value in os.environ.items() if key != "POLYGON_API_KEY"}  # random prices, no network
+    params = {"command": sys.executable, "args": ["market_server.py"], "env": env, "cwd": os.path.dirname(os.path.abspath(__file__))}
+
+    async def cycle(server):
+        await server.list_tools()
+        await server.call_tool("lookup_share_price", {"symbol": "AAPL"})
+
+    async def run():
+        start = time.perf_counter()
+        for _ in range(cycles):
+            async with MCPServerStdio(params) as server:
+                await cycle(server)
+        report("before: server started per cycle", cycles, time.perf_counter() - start)
+
+        supervisor = MCPSupervisor()
+        [server] = supervisor.servers_for({"market": params})
+        start = time.perf_counter()
+        await supervisor.start()
+        for _ in range(cycles):
+            await cycle(server)
+        report("after:  supervised server (incl. startup)", cycles, time.perf_counter() - start)
+        print(supervisor.report())
+        await supervisor.stop()
+
+    print(f"mcp servers: {cycles} cycles of list_tools + one tool call")
+    asyncio.run(run())
+
+
+def bench_prompt_tokens(days: int = 21, runs_per_day: int = 13, trades_per_run: int = 3) -> None:
+    """
+    Estimated prompt tokens of the account in the trade message over a simulated month: full report
+    versus compact summary, and the size of the last trade tool result each day.
+    """
+    import json
+    import random
+    import accounts
+    import market
+
+    market.polygon_api_key = None  # random prices, no network
+    rng = random.Random(0)
+    symbols = ["AAPL", "MSFT", "NVDA", "AMZN", "GOOGL", "META", "TSLA", "JPM", "XOM", "SPY", "QQQ", "GLD"]
+    account = accounts.Account.get("prompt_bench")
+    account.reset("")
+
+    def full_report() -> str:
+        # What Trader.get_account_report sent before the compact summary
+        report = json.loads(account.report())
+        report.pop("portfolio_value_time_series", None)
+        return json.dumps(report)
+
+    print(f"prompt tokens: {days} days x {runs_per_day} runs x up to {trades_per_run} trades, ~{accounts.CHARS_PER_TOKEN} chars a token")
+    print(f"{'day':>4} {'trades':>7} {'full report':>12} {'summary':>8} {'trade result':>13}")
+    totals = [0, 0]
+    trade = 0
+    for day in range(1, days + 1):
+        for _ in range(runs_per_day):
+            for _ in range(rng.randint(0, trades_per_run)):
+                symbol = rng.choice(symbols)
+                rationale = "Position sized to the strategy after reviewing recent news, earnings and momentum. " * rng.randint(1, 3)
+                try:
+                    if account.holdings.get(symbol) and rng.random() < 0.4:
+                        result = account.sell_shares(symbol, rng.randint(1, account.holdings[symbol]), rationale)
+                    else:
+                        result = account.buy_shares(symbol, rng.randint(1, 5), rationale)
+                    trade = accounts.estimate_tokens(result)
+                except ValueError:
+                    pass
+            full, summary = accounts.estimate_tokens(full_report()), accounts.estimate_tokens(account.summary())
+            totals[0] += full
+            totals[1] += summary
+        if day == 1 or day % 5 == 0 or day == days:
+            print(f"{day:>4} {len(account.transactions):>7} {full:>12,} {summary:>8,} {trade:>13,}")
+    print(f"total over {days * runs_per_day} runs: full report {totals[0]:,} tokens, summary {totals[1]:,} tokens")
+
+
+def stress_worker(seed: int, trades: int) -> tuple[int, dict]:
+    """ Trade randomly on the shared stress account; return how many trades succeeded and the commit stats. """
+    import random
+    import accounts
+    import market
+
+    market.polygon_api_key = None  # random prices, no network
+    rng = random.Random(seed)
+    cache = accounts.AccountCache()
+    completed = 0
+    for _ in range(trades):
+        account = cache.get("stress")
+        symbol = rng.choice(["AAPL", "MSFT", "NVDA"])
+        try:
+            if rng.random() < 0.6:
+                account.buy_shares(symbol, rng.randint(1, 3), "stress")
+            else:
+                account.sell_shares(symbol, rng.randint(1, 3), "stress")
+            completed += 1
+        except ValueError:
+            pass
+    return completed, accounts.commit_stats
+
+
+def bench_stress(processes: int = 4, trades: int = 500) -> None:
+    """ Concurrent trades on one account from several processes: no update may be lost. """
+    import multiprocessing
+    from accounts import Account, INITIAL_BALANCE
+
+    Account.get("stress").reset("")
+    print(f"stress: {processes} processes x {trades} random trades on one account")
+    start = time.perf_counter()
+    with multiprocessing.get_context("spawn").Pool(processes) as pool:
+        results = pool.starmap(stress_worker, [(seed, trades) for seed in range(processes)])
+    elapsed = time.perf_counter() - start
+
+    completed = sum(done for done, _ in results)
+    conflicts = sum(stats["conflicts"] for _, stats in results)
+    report("trades", completed, elapsed)
+    print(f"completed {completed} trades, {conflicts} version conflicts retried")
+
+    account = Account.get("stress")
+    expected_balance = INITIAL_BALANCE - sum(t.total() for t in account.transactions)
+    problems = account.verify_aggregates()
+    if len(account.transactions) != completed:
+        problems.append(f"{len(account.transactions)} transactions stored for {completed} completed trades")
+    if abs(account.balance - expected_balance) > 1e-6:
+        problems.append(f"balance {account.balance} but transactions imply {expected_balance}")
+    print("consistent" if not problems else "INCONSISTENT:\n  " + "\n  ".join(problems))
+    if problems:
+        # Fail the run, so the stress test can gate a change
+        sys.exit(1)
+
+
+BENCHMARKS = {
+    "database": bench_database,
+    "polygon_client": bench_polygon_client,
+    "snapshots": bench_snapshots,
+    "accounts_client": bench_accounts_client,
+    "mcp_servers": bench_mcp_servers,
+    "prompt_tokens": bench_prompt_tokens,
+    "stress": bench_stress,
+}
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
@@ -1,16 +1,220 @@
 import sqlite3
 import json
-from datetime import datetime
+import os
+import queue
+import signal
+import threading
+import time
+import atexit
+from contextlib import contextmanager
+from typing import Callable
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
+from ledger import replay
 
 load_dotenv(override=True)
 
-DB = "accounts.db"
+DB = os.getenv("ACCOUNTS_DB", "accounts.db")
 
+# Traders, MCP servers and the dashboard all share one DB file from several processes,
+# so connections run in WAL mode (readers never block the single writer) and wait on
+# locks instead of failing immediately with "database is locked".
+BUSY_TIMEOUT_MS = 5_000
 
-with sqlite3.connect(DB) as conn:
-    cursor = conn.cursor()
-    cursor.execute('CREATE TABLE IF NOT EXISTS accounts (name TEXT PRIMARY KEY, account TEXT)')
+_local = threading.local()
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(DB, timeout=BUSY_TIMEOUT_MS / 1000)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    return conn
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Return the connection owned by the calling thread, opening it on first use.
+
+    Connections are pooled per thread and per process: sqlite3 connections must not be
+    shared across threads, and a connection inherited through fork() is never reused.
+    Reusing the connection also keeps its prepared statement cache warm.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.pid != os.getpid():
+        conn = _connect()
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+
+def close_connection() -> None:
+    """ Close the calling thread's pooled connection, if any. """
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.pid == os.getpid():
+        conn.close()
+    _local.conn = None
+
+
+@contextmanager
+def transaction():
+    """ Yield a cursor on the pooled connection, committing on success and rolling back on error. """
+    conn = get_connection()
+    with conn:
+        yield conn.cursor()
+
+
+def _columns(cursor, table: str) -> set[str]:
+    return {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+
+
+def _rebuild_aggregates(cursor, name: str) -> None:
+    """ Recompute the running P&L aggregates of an account from its transactions. """
+    trades = cursor.execute('SELECT symbol, quantity, price FROM transactions WHERE name = ? ORDER BY id', (name,)).fetchall()
+    _, positions = replay(trades)
+    cursor.execute('UPDATE holdings SET cost_basis = 0, realized_pnl = 0, net_invested = 0 WHERE name = ?', (name,))
+    for symbol, position in positions.items():
+        cursor.execute('''
+            INSERT INTO holdings (name, symbol, quantity, cost_basis, realized_pnl, net_invested)
+            VALUES (?, ?, 0, ?, ?, ?)
+            ON CONFLICT(name, symbol) DO UPDATE SET
+                cost_basis=excluded.cost_basis, realized_pnl=excluded.realized_pnl, net_invested=excluded.net_invested
+        ''', (name, symbol, position.cost_basis, position.realized_pnl, position.net_invested))
+    cursor.execute(
+        'UPDATE accounts SET net_invested = ?, realized_pnl = ? WHERE name = ?',
+        (sum(p.net_invested for p in positions.values()), sum(p.realized_pnl for p in positions.values()), name),
+    )
+
+
+# Portfolio values are kept raw for RAW_RETENTION, and rolled up into buckets with the min,
+# max and last value for each resolution. Each resolution is kept for its retention period
+# (None is forever), so storage stays bounded however long the floor runs.
+RAW_RETENTION = timedelta(days=1)
+ROLLUPS = (
+    # (resolution, length of the "YYYY-MM-DD HH:MM:SS" prefix that identifies a bucket, retention)
+    ("minute", 16, timedelta(days=7)),
+    ("hour", 13, timedelta(days=90)),
+    ("day", 10, None),
+)
+CHART_POINTS = 500
+
+
+def _format(dt: datetime) -> str:
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _bucket(dt: str, prefix: int) -> str:
+    return dt[:prefix] + "0000-00-00 00:00:00"[prefix:]
+
+
+def _write_rollups(cursor, name: str, dt: str, value: float) -> None:
+    for resolution, prefix, _ in ROLLUPS:
+        cursor.execute('''
+            INSERT INTO portfolio_rollups (name, resolution, bucket, min, max, last)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(name, resolution, bucket) DO UPDATE SET
+                min=min(min, excluded.min), max=max(max, excluded.max), last=excluded.last
+        ''', (name, resolution, _bucket(dt, prefix), value, value, value))
+
+
+def _migrate_legacy_accounts(cursor) -> None:
+    """
+    Copy accounts stored in the old layout (one JSON document per account) into the
+    normalized tables. The legacy table is kept as accounts_legacy and rows that were
+    already migrated are skipped, so this is safe to run on every start.
+    """
+    rows = cursor.execute('''
+        SELECT name, account FROM accounts_legacy
+        WHERE name NOT IN (SELECT name FROM accounts)
+    ''').fetchall()
+    for name, account_json in rows:
+        account = json.loads(account_json)
+        cursor.execute(
+            'INSERT INTO accounts (name, balance, strategy) VALUES (?, ?, ?)',
+            (name, account["balance"], account["strategy"]),
+        )
+        cursor.executemany(
+            'INSERT INTO holdings (name, symbol, quantity) VALUES (?, ?, ?)',
+            [(name, symbol, quantity) for symbol, quantity in account["holdings"].items()],
+        )
+        cursor.executemany(
+            'INSERT INTO transactions (name, symbol, quantity, price, timestamp, rationale) VALUES (?, ?, ?, ?, ?, ?)',
+            [(name, t["symbol"], t["quantity"], t["price"], t["timestamp"], t["rationale"]) for t in account["transactions"]],
+        )
+        cursor.executemany(
+            'INSERT INTO portfolio_values (name, datetime, value) VALUES (?, ?, ?)',
+            [(name, dt, value) for dt, value in account["portfolio_value_time_series"]],
+        )
+        # The raw values are soon pruned, so the history only survives in the rollups
+        for dt, value in account["portfolio_value_time_series"]:
+            _write_rollups(cursor, name, dt, value)
+        _rebuild_aggregates(cursor, name)
+
+
+with transaction() as cursor:
+    # Every process importing this module runs the setup below. sqlite3 doesn't open a transaction
+    # for DDL by itself, so take the write lock up front: the legacy check and the rename then run
+    # in one process at a time, and later processes find the schema already migrated.
+    cursor.execute('BEGIN IMMEDIATE')
+    if "account" in _columns(cursor, "accounts"):
+        cursor.execute('ALTER TABLE accounts RENAME TO accounts_legacy')
+
+    # version is incremented by every write to an account, so cached copies can be checked with one lookup
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS accounts (
+            name TEXT PRIMARY KEY,
+            balance REAL NOT NULL,
+            strategy TEXT NOT NULL DEFAULT '',
+            net_invested REAL NOT NULL DEFAULT 0,
+            realized_pnl REAL NOT NULL DEFAULT 0,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    # One row per symbol ever traded. Rows are kept at quantity 0 to preserve the symbol's realized P&L.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS holdings (
+            name TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            cost_basis REAL NOT NULL DEFAULT 0,
+            realized_pnl REAL NOT NULL DEFAULT 0,
+            net_invested REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (name, symbol)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            price REAL NOT NULL,
+            timestamp TEXT NOT NULL,
+            rationale TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_transactions_name ON transactions (name, id)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS portfolio_values (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            datetime TEXT NOT NULL,
+            value REAL NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_portfolio_values_name ON portfolio_values (name, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_portfolio_values_datetime ON portfolio_values (name, datetime)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS portfolio_rollups (
+            name TEXT NOT NULL,
+            resolution TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            min REAL NOT NULL,
+            max REAL NOT NULL,
+            last REAL NOT NULL,
+            PRIMARY KEY (name, resolution, bucket)
+        ) WITHOUT ROWID
+    ''')
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS logs (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -20,82 +224,515 @@ with sqlite3.connect(DB) as conn:
             message TEXT
         )
     ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_logs_name ON logs (name, id)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS spans (
+            span_id TEXT PRIMARY KEY,
+            trace_id TEXT NOT NULL,
+            parent_id TEXT,
+            trader TEXT,
+            type TEXT NOT NULL,
+            name TEXT,
+            server TEXT,
+            start TEXT NOT NULL,
+            end TEXT NOT NULL,
+            duration REAL NOT NULL,
+            error TEXT
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_spans_trader ON spans (trader, start)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_spans_trace ON spans (trace_id)')
     cursor.execute('CREATE TABLE IF NOT EXISTS market (date TEXT PRIMARY KEY, data TEXT)')
-    conn.commit()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS bars (
+            symbol TEXT NOT NULL,
+            date TEXT NOT NULL,
+            open REAL,
+            high REAL,
+            low REAL,
+            close REAL,
+            volume REAL,
+            PRIMARY KEY (symbol, date)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS market_snapshots (
+            date TEXT PRIMARY KEY,
+            symbols BLOB NOT NULL,
+            prices BLOB NOT NULL
+        )
+    ''')
+
+    if _columns(cursor, "accounts_legacy"):
+        _migrate_legacy_accounts(cursor)
+
+def _write_position(cursor, name: str, symbol: str, quantity: int, position: dict) -> None:
+    cursor.execute('''
+        INSERT INTO holdings (name, symbol, quantity, cost_basis, realized_pnl, net_invested)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(name, symbol) DO UPDATE SET
+            quantity=excluded.quantity, cost_basis=excluded.cost_basis,
+            realized_pnl=excluded.realized_pnl, net_invested=excluded.net_invested
+    ''', (name, symbol, quantity, position["cost_basis"], position["realized_pnl"], position["net_invested"]))
+
+class VersionConflict(Exception):
+    """ Raised when an account was written by someone else since the version a write expected. """
 
-def write_account(name, account_dict):
-    json_data = json.dumps(account_dict)
-    with sqlite3.connect(DB) as conn:
-        cursor = conn.cursor()
+
+def _write_account_row(cursor, name: str, account_dict: dict, version: int | None) -> int:
+    """
+    Write the balance, strategy and totals of an account and bump its version; return the new version.
+    If `version` is given, only write if the stored version still matches it (compare-and-swap).
+    """
+    values = (account_dict["balance"], account_dict["strategy"], account_dict["net_invested"], account_dict["realized_pnl"], name)
+    if version is None:
         cursor.execute('''
-            INSERT INTO accounts (name, account)
-            VALUES (?, ?)
-            ON CONFLICT(name) DO UPDATE SET account=excluded.account
-        ''', (name.lower(), json_data))
-        conn.commit()
+            UPDATE accounts SET balance = ?, strategy = ?, net_invested = ?, realized_pnl = ?, version = version + 1
+            WHERE name = ?
+        ''', values)
+        return cursor.execute('SELECT version FROM accounts WHERE name = ?', (name,)).fetchone()[0]
+    cursor.execute('''
+        UPDATE accounts SET balance = ?, strategy = ?, net_invested = ?, realized_pnl = ?, version = version + 1
+        WHERE name = ? AND version = ?
+    ''', values + (version,))
+    if cursor.rowcount == 0:
+        raise VersionConflict(f"Account {name} changed since version {version}")
+    return version + 1
+
+def write_account(name, account_dict, version: int | None = None) -> int:
+    """
+    Write the balance, strategy, holdings and running aggregates of an account and return its new version.
+    With `version`, raise VersionConflict instead of writing if the account changed since that version.
+    Transactions and portfolio values are appended separately with write_trades and write_portfolio_value.
+    """
+    name = name.lower()
+    with transaction() as cursor:
+        cursor.execute('''
+            INSERT INTO accounts (name, balance, strategy)
+            VALUES (?, ?, ?)
+            ON CONFLICT(name) DO NOTHING
+        ''', (name, account_dict["balance"], account_dict["strategy"]))
+        version = _write_account_row(cursor, name, account_dict, version)
+        stored = {symbol for (symbol,) in cursor.execute('SELECT symbol FROM holdings WHERE name = ?', (name,))}
+        empty = {"cost_basis": 0.0, "realized_pnl": 0.0, "net_invested": 0.0}
+        for symbol in stored | account_dict["holdings"].keys() | account_dict["positions"].keys():
+            quantity = account_dict["holdings"].get(symbol, 0)
+            position = account_dict["positions"].get(symbol, empty)
+            if quantity or position != empty:
+                _write_position(cursor, name, symbol, quantity, position)
+            else:
+                cursor.execute('DELETE FROM holdings WHERE name = ? AND symbol = ?', (name, symbol))
+    return version
 
 def read_account(name):
-    with sqlite3.connect(DB) as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT account FROM accounts WHERE name = ?', (name.lower(),))
-        row = cursor.fetchone()
-        return json.loads(row[0]) if row else None
-    
+    """
+    Read the balance, strategy, holdings and running aggregates of an account, or None if it doesn't exist.
+    Transactions and portfolio values are read on demand with read_transactions and read_portfolio_values.
+    """
+    name = name.lower()
+    conn = get_connection()
+    row = conn.execute('SELECT balance, strategy, net_invested, realized_pnl, version FROM accounts WHERE name = ?', (name,)).fetchone()
+    if not row:
+        return None
+    positions = conn.execute('''
+        SELECT symbol, quantity, cost_basis, realized_pnl, net_invested FROM holdings
+        WHERE name = ?
+    ''', (name,)).fetchall()
+    return {
+        "name": name,
+        "balance": row[0],
+        "strategy": row[1],
+        "holdings": {symbol: quantity for symbol, quantity, *_ in positions if quantity},
+        "positions": {
+            symbol: {"cost_basis": cost_basis, "realized_pnl": realized_pnl, "net_invested": net_invested}
+            for symbol, _, cost_basis, realized_pnl, net_invested in positions
+        },
+        "net_invested": row[2],
+        "realized_pnl": row[3],
+        "version": row[4],
+    }
+
+def read_account_version(name: str) -> int | None:
+    """ Return the version of an account, or None if it doesn't exist. """
+    row = get_connection().execute('SELECT version FROM accounts WHERE name = ?', (name.lower(),)).fetchone()
+    return row[0] if row else None
+
+def reset_account(name: str, balance: float, strategy: str) -> int:
+    """ Reset an account to the given balance and strategy, removing its holdings and history; return its new version. """
+    name = name.lower()
+    with transaction() as cursor:
+        cursor.execute('''
+            INSERT INTO accounts (name, balance, strategy)
+            VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET
+                balance=excluded.balance, strategy=excluded.strategy, net_invested=0, realized_pnl=0,
+                version=version + 1
+        ''', (name, balance, strategy))
+        cursor.execute('DELETE FROM holdings WHERE name = ?', (name,))
+        cursor.execute('DELETE FROM transactions WHERE name = ?', (name,))
+        cursor.execute('DELETE FROM portfolio_values WHERE name = ?', (name,))
+        cursor.execute('DELETE FROM portfolio_rollups WHERE name = ?', (name,))
+        return cursor.execute('SELECT version FROM accounts WHERE name = ?', (name,)).fetchone()[0]
+
+def write_trades(name: str, account_dict: dict, transaction_dicts: list[dict], version: int | None = None) -> int:
+    """
+    Record trades in a single DB transaction: the account's new balance and totals, the
+    new holding and aggregates of each traded symbol, and the appended transaction rows.
+    Return the account's new version. With `version`, raise VersionConflict instead of
+    writing anything if the account changed since that version.
+    """
+    name = name.lower()
+    with transaction() as cursor:
+        version = _write_account_row(cursor, name, account_dict, version)
+        for symbol in {t["symbol"] for t in transaction_dicts}:
+            _write_position(cursor, name, symbol, account_dict["holdings"].get(symbol, 0), account_dict["positions"][symbol])
+        cursor.executemany('''
+            INSERT INTO transactions (name, symbol, quantity, price, timestamp, rationale)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', [(name, t["symbol"], t["quantity"], t["price"], t["timestamp"], t["rationale"]) for t in transaction_dicts])
+    return version
+
+def read_transactions(name: str) -> list[dict]:
+    cursor = get_connection().execute('''
+        SELECT symbol, quantity, price, timestamp, rationale FROM transactions
+        WHERE name = ?
+        ORDER BY id
+    ''', (name.lower(),))
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+def read_transaction_count(name: str) -> int:
+    return get_connection().execute('SELECT COUNT(*) FROM transactions WHERE name = ?', (name.lower(),)).fetchone()[0]
+
+def read_recent_transactions(name: str, limit: int) -> list[dict]:
+    """ Return the last `limit` transactions of an account, oldest first, without reading the rest. """
+    cursor = get_connection().execute('''
+        SELECT symbol, quantity, price, timestamp, rationale FROM transactions
+        WHERE name = ?
+        ORDER BY id DESC
+        LIMIT ?
+    ''', (name.lower(), limit))
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()][::-1]
+
+def write_portfolio_value(name: str, timestamp: str, value: float) -> None:
+    """ Append a raw portfolio value, update its rollup buckets and drop data past its retention. """
+    name = name.lower()
+    now = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
+    with transaction() as cursor:
+        cursor.execute(
+            'INSERT INTO portfolio_values (name, datetime, value) VALUES (?, ?, ?)',
+            (name, timestamp, value),
+        )
+        _write_rollups(cursor, name, timestamp, value)
+        cursor.execute(
+            'DELETE FROM portfolio_values WHERE name = ? AND datetime < ?',
+            (name, _format(now - RAW_RETENTION)),
+        )
+        for resolution, prefix, retention in ROLLUPS:
+            if retention:
+                cursor.execute(
+                    'DELETE FROM portfolio_rollups WHERE name = ? AND resolution = ? AND bucket < ?',
+                    (name, resolution, _bucket(_format(now - retention), prefix)),
+                )
+
+def read_portfolio_values(name: str, max_points: int = CHART_POINTS) -> list[tuple[str, float]]:
+    """
+    Return the portfolio value series of an account, oldest first, as at most max_points
+    (datetime, value) points: raw values for the most recent RAW_RETENTION, then the last
+    value of each bucket of the finest rollup still covering older periods.
+    """
+    name = name.lower()
+    conn = get_connection()
+    now = datetime.now()
+    raw_start = _format(now - RAW_RETENTION)
+    series = []
+    end = raw_start
+    for resolution, prefix, retention in ROLLUPS:
+        start = _bucket(_format(now - retention), prefix) if retention else ""
+        if start < end:
+            series += conn.execute('''
+                SELECT bucket, last FROM portfolio_rollups
+                WHERE name = ? AND resolution = ? AND bucket >= ? AND bucket < ?
+                ORDER BY bucket
+            ''', (name, resolution, start, end)).fetchall()[::-1]
+            end = start
+    series.reverse()
+    series += conn.execute('''
+        SELECT datetime, value FROM portfolio_values
+        WHERE name = ? AND datetime >= ?
+        ORDER BY id
+    ''', (name, raw_start)).fetchall()
+
+    if len(series) > max_points:
+        # Keep the last point of each of max_points evenly sized slices
+        step = len(series) / max_points
+        series = [series[int((i + 1) * step) - 1] for i in range(max_points)]
+    return series
+
+# Log entries are written in the background: a batch is committed every LOG_FLUSH_INTERVAL
+# seconds or LOG_BATCH_SIZE rows, whichever comes first. At most LOG_QUEUE_SIZE entries are
+# buffered; beyond that write_log blocks until the flusher has caught up.
+LOG_FLUSH_INTERVAL = 0.25
+LOG_BATCH_SIZE = 500
+LOG_QUEUE_SIZE = 10_000
+# A batch that failed because the database stayed locked is retried after this long, doubling up to the max
+LOG_RETRY_DELAY = 0.5
+LOG_MAX_RETRY_DELAY = 30.0
+
+
+class BatchWriter:
+    """
+    Queue of pending entries drained by a daemon thread, which hands them to `sink` in batches of
+    up to `batch_size`, each started at most `flush_interval` seconds after its first entry came.
+    """
+
+    def __init__(self, label: str, sink: Callable[[list], None], flush_interval: float = LOG_FLUSH_INTERVAL,
+                 batch_size: int = LOG_BATCH_SIZE, max_queued: int = LOG_QUEUE_SIZE):
+        self.label = label
+        self.sink = sink
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+
+    def write(self, entry) -> None:
+        """ Queue an entry, waiting for room if the queue is full. """
+        self._ensure_started()
+        self.queue.put(entry)
+
+    def offer(self, entry) -> bool:
+        """ Queue an entry unless the queue is full; return whether it was queued. """
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(entry)
+            return True
+        except queue.Full:
+            return False
+
+    def flush(self) -> None:
+        """ Block until every entry queued so far has been handed to the sink. """
+        if self.thread is not None and self.pid == os.getpid():
+            self.queue.join()
+
+    def _ensure_started(self) -> None:
+        if self.thread is not None and self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.thread is None or self.pid != os.getpid():
+                # A forked child inherits the queue but not the thread, so it starts over
+                self.queue = queue.Queue(maxsize=self.queue.maxsize)
+                self.thread = threading.Thread(target=self._run, name=f"{self.label}-writer", daemon=True)
+                self.pid = os.getpid()
+                self.thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                self.sink(batch)
+            except Exception as e:
+                print(f"Dropped {len(batch)} {self.label} entries due to {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+
+def insert_rows(sql: str) -> Callable[[list[tuple]], None]:
+    """
+    Return a BatchWriter sink that inserts each batch of rows with `sql` in one transaction,
+    retrying while the database is locked. Other errors would recur, so they are raised.
+    """
+    def insert(rows: list[tuple]) -> None:
+        delay = LOG_RETRY_DELAY
+        while True:
+            try:
+                with transaction() as cursor:
+                    cursor.executemany(sql, rows)
+                return
+            except sqlite3.Error as e:
+                if getattr(e, "sqlite_errorcode", None) not in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED):
+                    raise
+                print(f"Retrying {len(rows)} rows in {delay:.1f}s due to {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, LOG_MAX_RETRY_DELAY)
+    return insert
+
+
+log_writer = BatchWriter("log", insert_rows('''
+    INSERT INTO logs (name, datetime, type, message)
+    VALUES (?, ?, ?, ?)
+'''))
+atexit.register(log_writer.flush)
+
+span_writer = BatchWriter("span", insert_rows('''
+    INSERT OR IGNORE INTO spans (span_id, trace_id, parent_id, trader, type, name, server, start, end, duration, error)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''))
+atexit.register(span_writer.flush)
+
+
+def _exit_on_sigterm(signum, frame):
+    # Exiting normally runs the atexit hooks above, which commit what is still queued
+    raise SystemExit(128 + signum)
+
+# MCP clients stop server processes with SIGTERM, whose default action skips atexit.
+# Only replace the default action, and only from the main thread, where handlers can be set.
+if threading.current_thread() is threading.main_thread() and signal.getsignal(signal.SIGTERM) is signal.SIG_DFL:
+    signal.signal(signal.SIGTERM, _exit_on_sigterm)
+
 def write_log(name: str, type: str, message: str):
     """
-    Write a log entry to the logs table.
-    
+    Queue a log entry for the logs table. It is committed in the background shortly after;
+    call flush_logs() to wait for it.
+
     Args:
         name (str): The name associated with the log
         type (str): The type of log entry
         message (str): The log message
     """
-    now = datetime.now().isoformat()
-    
-    with sqlite3.connect(DB) as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO logs (name, datetime, type, message)
-            VALUES (?, datetime('now'), ?, ?)
-        ''', (name.lower(), type, message))
-        conn.commit()
+    now = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    log_writer.write((name.lower(), now, type, message))
+
+def flush_logs() -> None:
+    """ Wait until all queued log entries have been written. """
+    log_writer.flush()
 
 def read_log(name: str, last_n=10):
     """
     Read the most recent log entries for a given name.
-    
+
     Args:
         name (str): The name to retrieve logs for
         last_n (int): Number of most recent entries to retrieve
-        
+
     Returns:
         list: A list of tuples containing (datetime, type, message)
     """
-    with sqlite3.connect(DB) as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT datetime, type, message FROM logs 
-            WHERE name = ? 
-            ORDER BY datetime DESC
-            LIMIT ?
-        ''', (name.lower(), last_n))
-        
-        return reversed(cursor.fetchall())
-
-def write_market(date: str, data: dict) -> None:
-    data_json = json.dumps(data)
-    with sqlite3.connect(DB) as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO market (date, data)
-            VALUES (?, ?)
-            ON CONFLICT(date) DO UPDATE SET data=excluded.data
-        ''', (date, data_json))
-        conn.commit()
+    cursor = get_connection().execute('''
+        SELECT datetime, type, message FROM logs
+        WHERE name = ?
+        ORDER BY id DESC
+        LIMIT ?
+    ''', (name.lower(), last_n))
+
+    return reversed(cursor.fetchall())
+
+def read_log_since(name: str, last_id: int = 0, last_n=10):
+    """
+    Read the log entries for a given name written after the entry with id last_id.
+    This is an index seek on (name, id), so polling it with the last id seen is cheap.
+
+    Args:
+        name (str): The name to retrieve logs for
+        last_id (int): Id of the last entry already seen, 0 for none
+        last_n (int): Maximum number of entries to retrieve; the most recent ones are kept
+
+    Returns:
+        list: A list of tuples containing (id, datetime, type, message), oldest first
+    """
+    cursor = get_connection().execute('''
+        SELECT id, datetime, type, message FROM logs
+        WHERE name = ? AND id > ?
+        ORDER BY id DESC
+        LIMIT ?
+    ''', (name.lower(), last_id, last_n))
+
+    return cursor.fetchall()[::-1]
+
+def write_span(span_id: str, trace_id: str, parent_id: str | None, trader: str | None, type: str, name: str | None,
+               server: str | None, start: str, end: str, duration: float, error: str | None) -> None:
+    """ Queue a finished span for the spans table; like log entries, spans are committed in the background. """
+    span_writer.write((span_id, trace_id, parent_id, trader, type, name, server, start, end, duration, error))
+
+def flush_spans() -> None:
+    """ Wait until all queued spans have been written. """
+    span_writer.flush()
+
+def read_span_breakdown(trader: str, since: str | None = None) -> list[dict]:
+    """
+    Summarize where a trader's runs spent their time: one row per span type, name and MCP server
+    with the count, total, mean and max duration in seconds and the number of errors, largest
+    total first. `since` is an ISO timestamp to only include spans that started after it.
+    """
+    rows = get_connection().execute('''
+        SELECT type, name, server, COUNT(*), SUM(duration), AVG(duration), MAX(duration), COUNT(error)
+        FROM spans
+        WHERE trader = ? AND start >= ?
+        GROUP BY type, name, server
+        ORDER BY SUM(duration) DESC
+    ''', (trader.lower(), since or "")).fetchall()
+    return [
+        {"type": type, "name": name, "server": server, "count": count, "total": total, "mean": mean, "max": longest, "errors": errors}
+        for type, name, server, count, total, mean, longest, errors in rows
+    ]
+
+def read_trace_spans(trace_id: str) -> list[dict]:
+    """ All spans of one trace, in the order they started. """
+    cursor = get_connection().execute('''
+        SELECT span_id, parent_id, type, name, server, start, end, duration, error FROM spans
+        WHERE trace_id = ?
+        ORDER BY start
+    ''', (trace_id,))
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
 
 def read_market(date: str) -> dict | None:
-    with sqlite3.connect(DB) as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT data FROM market WHERE date = ?', (date,))
-        row = cursor.fetchone()
-        return json.loads(row[0]) if row else None
\ No newline at end of file
+    """ Read a market snapshot stored as JSON, the layout used before market_snapshots. """
+    cursor = get_connection().execute('SELECT data FROM market WHERE date = ?', (date,))
+    row = cursor.fetchone()
+    return json.loads(row[0]) if row else None
+
+def write_market_snapshot(date: str, symbols: bytes, prices: bytes) -> None:
+    with transaction() as cursor:
+        cursor.execute('''
+            INSERT INTO market_snapshots (date, symbols, prices)
+            VALUES (?, ?, ?)
+            ON CONFLICT(date) DO UPDATE SET symbols=excluded.symbols, prices=excluded.prices
+        ''', (date, symbols, prices))
+
+def read_market_snapshot(date: str) -> tuple[bytes, bytes] | None:
+    """ Return the (symbols, prices) columns of the snapshot for a date, see snapshots.Snapshot. """
+    cursor = get_connection().execute('SELECT symbols, prices FROM market_snapshots WHERE date = ?', (date,))
+    return cursor.fetchone()
+
+def write_bars(bars: list[tuple]) -> None:
+    """
+    Insert or replace daily bars in one transaction.
+
+    Args:
+        bars (list): Tuples of (symbol, date, open, high, low, close, volume), date as YYYY-MM-DD
+    """
+    with transaction() as cursor:
+        cursor.executemany('''
+            INSERT INTO bars (symbol, date, open, high, low, close, volume)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(symbol, date) DO UPDATE SET
+                open=excluded.open, high=excluded.high, low=excluded.low,
+                close=excluded.close, volume=excluded.volume
+        ''', bars)
+
+def read_bars(symbol: str, start: str, end: str) -> list[tuple]:
+    """ Return (date, open, high, low, close, volume) for a symbol between two dates inclusive, oldest first. """
+    cursor = get_connection().execute('''
+        SELECT date, open, high, low, close, volume FROM bars
+        WHERE symbol = ? AND date BETWEEN ? AND ?
+        ORDER BY date
+    ''', (symbol, start, end))
+    return cursor.fetchall()
+
+def read_bar_dates() -> list[str]:
+    """ Return every date that has at least one bar stored. """
+    cursor = get_connection().execute('SELECT DISTINCT date FROM bars ORDER BY date')
+    return [date for (date,) in cursor.fetchall()]
@@ -0,0 +1,36 @@
+from pydantic import BaseModel
+from typing import Iterable
+
+
+class Position(BaseModel):
+    """ Running aggregates for one symbol, kept up to date trade by trade. """
+    cost_basis: float = 0.0     # what the shares currently held cost, at average cost
+    realized_pnl: float = 0.0   # profit or loss locked in by sells
+    net_invested: float = 0.0   # buy costs minus sell proceeds
+
+    def apply(self, held: int, quantity: int, price: float) -> float:
+        """
+        Apply a trade of `quantity` shares (negative for a sell) at `price` to a position of
+        `held` shares before the trade. Return the profit or loss it realized.
+        """
+        total = quantity * price
+        self.net_invested += total
+        if quantity >= 0:
+            self.cost_basis += total
+            return 0.0
+        cost_sold = self.cost_basis * -quantity / held if held else 0.0
+        realized = -total - cost_sold
+        self.cost_basis -= cost_sold
+        self.realized_pnl += realized
+        return realized
+
+
+def replay(trades: Iterable[tuple[str, int, float]]) -> tuple[dict[str, int], dict[str, Position]]:
+    """ Recompute holdings and positions from scratch from (symbol, quantity, price) trades, oldest first. """
+    holdings = {}
+    positions = {}
+    for symbol, quantity, price in trades:
+        held = holdings.get(symbol, 0)
+        positions.setdefault(symbol, Position()).apply(held, quantity, price)
+        holdings[symbol] = held + quantity
+    return {symbol: quantity for symbol, quantity in holdings.items() if quantity}, positions
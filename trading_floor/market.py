@@ -1,10 +1,15 @@
 from polygon import RESTClient
+from urllib3 import Timeout
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 import os
+import threading
 from datetime import datetime
 import random
-from database import write_market, read_market
+from database import read_market, write_market_snapshot, read_market_snapshot, write_bars
 from functools import lru_cache
+from pricing import PriceCache, CircuitBreaker
+from snapshots import Snapshot
 
 load_dotenv(override=True)
 
@@ -14,48 +19,128 @@ polygon_plan = os.getenv("POLYGON_PLAN")
 is_paid_polygon = polygon_plan == "paid"
 is_realtime_polygon = polygon_plan == "realtime"
 
+PRICE_CACHE_TTL = float(os.getenv("PRICE_CACHE_TTL", "60"))
+# Symbols whose lookup failed are not retried for this long
+PRICE_NEGATIVE_TTL = float(os.getenv("PRICE_NEGATIVE_TTL", "30"))
+# Polygon is skipped entirely after this many consecutive failures, until the cool-down has passed
+POLYGON_FAILURE_THRESHOLD = int(os.getenv("POLYGON_FAILURE_THRESHOLD", "3"))
+POLYGON_COOL_DOWN = float(os.getenv("POLYGON_COOL_DOWN", "60"))
+
+# Connection settings for the shared Polygon client
+POLYGON_BASE_URL = os.getenv("POLYGON_BASE_URL", "https://api.polygon.io")
+POLYGON_POOL_SIZE = int(os.getenv("POLYGON_POOL_SIZE", "4"))
+POLYGON_CONNECT_TIMEOUT = float(os.getenv("POLYGON_CONNECT_TIMEOUT", "5"))
+POLYGON_READ_TIMEOUT = float(os.getenv("POLYGON_READ_TIMEOUT", "10"))
+POLYGON_RETRIES = int(os.getenv("POLYGON_RETRIES", "3"))
+POLYGON_BACKOFF = float(os.getenv("POLYGON_BACKOFF", "0.5"))
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client() -> RESTClient:
+    """
+    Return the process-wide Polygon client, creating it on first use.
+    Sharing it keeps TLS sessions and keep-alive connections open between calls;
+    the underlying urllib3 pool is thread-safe.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                client = RESTClient(
+                    polygon_api_key,
+                    connect_timeout=POLYGON_CONNECT_TIMEOUT,
+                    read_timeout=POLYGON_READ_TIMEOUT,
+                    retries=POLYGON_RETRIES,
+                    base=POLYGON_BASE_URL,
+                )
+                # RESTClient doesn't expose these: connections kept per host and the retry backoff.
+                # Nor does it pass its timeouts on to its requests, so they are set on the pool too.
+                client.client.connection_pool_kw["maxsize"] = POLYGON_POOL_SIZE
+                client.client.connection_pool_kw["timeout"] = Timeout(connect=POLYGON_CONNECT_TIMEOUT, read=POLYGON_READ_TIMEOUT)
+                client.client.connection_pool_kw["retries"] = Retry(
+                    total=POLYGON_RETRIES,
+                    backoff_factor=POLYGON_BACKOFF,
+                    status_forcelist=[413, 429, 499, 500, 502, 503, 504],
+                )
+                _client = client
+    return _client
+
+def client_stats() -> dict[str, int]:
+    """ Requests sent and connections opened by the shared client; every other request reused a connection. """
+    requests = connections = 0
+    if _client is not None:
+        pools = _client.client.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                requests += pool.num_requests
+                connections += pool.num_connections
+    return {"requests": requests, "connections": connections, "reused": requests - connections}
+
 def is_market_open() -> bool:
-    client = RESTClient(polygon_api_key)
+    client = get_client()
     market_status = client.get_market_status()
     return market_status.market == "open"
 
+def get_grouped_daily_bars(day) -> list[tuple]:
+    """ Fetch the daily bars of every symbol for one day as (symbol, date, open, high, low, close, volume). """
+    results = get_client().get_grouped_daily_aggs(day, adjusted=True, include_otc=False)
+    date = str(day)
+    return [(r.ticker, date, r.open, r.high, r.low, r.close, r.volume) for r in results]
+
 def get_all_share_prices_polygon_eod() -> dict[str, float]:
-    client = RESTClient(polygon_api_key)
+    client = get_client()
 
     probe = client.get_previous_close_agg("SPY")[0]
     last_close = datetime.fromtimestamp(probe.timestamp/1000).date()
 
-    results = client.get_grouped_daily_aggs(last_close, adjusted=True, include_otc=False)
-    return {result.ticker: result.close for result in results}
+    # The grouped response has the full OHLCV for every symbol, so keep it for the bar history too
+    bars = get_grouped_daily_bars(last_close)
+    write_bars(bars)
+    return {symbol: close for symbol, _, _, _, _, close, _ in bars}
 
 @lru_cache(maxsize=2)
-def get_market_for_prior_date(today):
-    market_data = read_market(today)
-    if not market_data:
-        market_data = get_all_share_prices_polygon_eod()
-        write_market(today, market_data)
-    return market_data
-
-def get_share_price_polygon_eod(symbol) -> float:
+def get_market_for_prior_date(today) -> Snapshot:
+    columns = read_market_snapshot(today)
+    if columns:
+        return Snapshot(*columns)
+    # Fall back to a snapshot stored as JSON by an older version before going to Polygon
+    market_data = read_market(today) or get_all_share_prices_polygon_eod()
+    snapshot = Snapshot.from_dict(market_data)
+    write_market_snapshot(today, snapshot.symbols, snapshot.prices)
+    return snapshot
+
+def get_share_prices_polygon_eod(symbols: list[str]) -> dict[str, float]:
     today = datetime.now().date().strftime("%Y-%m-%d")
     market_data = get_market_for_prior_date(today)
-    return market_data.get(symbol, 0.0)
+    return {symbol: market_data.get(symbol, 0.0) for symbol in symbols}
 
-def get_share_price_polygon_min(symbol) -> float:
-    client = RESTClient(polygon_api_key)
-    result = client.get_snapshot_ticker("stocks", symbol)
-    return result.min.close
+def get_share_prices_polygon_min(symbols: list[str]) -> dict[str, float]:
+    client = get_client()
+    snapshots = client.get_snapshot_all("stocks", tickers=symbols)
+    return {snapshot.ticker: snapshot.min.close for snapshot in snapshots if snapshot.min}
 
-def get_share_price_polygon(symbol) -> float:
+def get_share_prices_polygon(symbols: list[str]) -> dict[str, float]:
     if is_paid_polygon:
-        return get_share_price_polygon_min(symbol)
+        return get_share_prices_polygon_min(symbols)
     else:
-        return get_share_price_polygon_eod(symbol)
+        return get_share_prices_polygon_eod(symbols)
+
+polygon_breaker = CircuitBreaker(failure_threshold=POLYGON_FAILURE_THRESHOLD, reset_timeout=POLYGON_COOL_DOWN)
+price_cache = PriceCache(get_share_prices_polygon, ttl=PRICE_CACHE_TTL, negative_ttl=PRICE_NEGATIVE_TTL, breaker=polygon_breaker)
+
+def get_share_prices(symbols: list[str]) -> dict[str, float]:
+    """
+    Return the price of every symbol, fetching the ones that aren't cached in one request.
+    Symbols that can't be priced through Polygon get a random price.
+    """
+    prices = price_cache.get_many(symbols) if polygon_api_key else {}
+    return {symbol: prices[symbol] if symbol in prices else float(random.randint(1, 100)) for symbol in symbols}
+
+def price_stats() -> dict:
+    """ Counters for the price cache, the Polygon circuit breaker and the shared client. """
+    return {**price_cache.stats(), "client": client_stats()}
 
 def get_share_price(symbol) -> float:
-    if polygon_api_key:
-        try:
-            return get_share_price_polygon(symbol)
-        except Exception as e:
-            print(f"Was not able to use the polygon API due to {e}; using a random number")
-    return float(random.randint(1, 100))
\ No newline at end of file
+    return get_share_prices([symbol])[symbol]
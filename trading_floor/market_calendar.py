@@ -0,0 +1,83 @@
+import json
+import os
+import time
+from datetime import date, datetime, timedelta
+from typing import Callable
+from zoneinfo import ZoneInfo
+
+CALENDAR_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "market_calendar.json")
+
+
+class MarketCalendar:
+    """
+    Exchange trading calendar loaded from a data file: regular hours, holidays and early closes.
+
+    Answers "is the market open?" locally. Days after the last year listed in the file are
+    treated as regular weekdays, so keep the file up to date or reconcile against the API.
+    """
+
+    def __init__(self, path: str = CALENDAR_FILE):
+        with open(path) as f:
+            data = json.load(f)
+        self.timezone = ZoneInfo(data["timezone"])
+        self.open_time = datetime.strptime(data["open"], "%H:%M").time()
+        self.close_time = datetime.strptime(data["close"], "%H:%M").time()
+        self.early_close_time = datetime.strptime(data["early_close"], "%H:%M").time()
+        self.holidays = {date.fromisoformat(day) for day in data["holidays"]}
+        self.early_closes = {date.fromisoformat(day) for day in data["early_closes"]}
+        # Set by reconcile() when the API disagrees with the calendar: (is_open, until)
+        self.override: tuple[bool, float] | None = None
+
+    def now(self) -> datetime:
+        return datetime.now(self.timezone)
+
+    def session(self, day: date) -> tuple[datetime, datetime] | None:
+        """ Return the opening and closing time on the given day, or None if the market doesn't open. """
+        if day.weekday() >= 5 or day in self.holidays:
+            return None
+        close_time = self.early_close_time if day in self.early_closes else self.close_time
+        return (
+            datetime.combine(day, self.open_time, tzinfo=self.timezone),
+            datetime.combine(day, close_time, tzinfo=self.timezone),
+        )
+
+    def is_open(self, at: datetime | None = None) -> bool:
+        if at is None:
+            if self.override and self.override[1] > time.monotonic():
+                return self.override[0]
+            at = self.now()
+        at = at.astimezone(self.timezone)
+        session = self.session(at.date())
+        return session is not None and session[0] <= at < session[1]
+
+    def next_open(self, at: datetime | None = None) -> datetime:
+        """ Return the start of the next session after `at`, or `at` itself if the market is open. """
+        at = (at or self.now()).astimezone(self.timezone)
+        day = at.date()
+        while True:
+            session = self.session(day)
+            if session and at < session[1]:
+                return max(at, session[0])
+            day += timedelta(days=1)
+
+    def seconds_until_open(self, at: datetime | None = None) -> float:
+        at = at or self.now()
+        # Compare timestamps: subtracting datetimes in the same zone ignores DST changes in between
+        return self.next_open(at).timestamp() - at.timestamp()
+
+    def reconcile(self, is_market_open: Callable[[], bool], valid_for: float) -> None:
+        """
+        Compare the calendar with a live market status check. If they disagree (an unscheduled
+        closure or a missing holiday), trust the live status for the next `valid_for` seconds.
+        """
+        try:
+            live = is_market_open()
+        except Exception as e:
+            print(f"Was not able to check the market status due to {e}; using the calendar")
+            return
+        expected = self.is_open(self.now())
+        if live != expected:
+            print(f"Market calendar says {'open' if expected else 'closed'} but the API says {'open' if live else 'closed'}")
+            self.override = (live, time.monotonic() + valid_for)
+        else:
+            self.override = None
@@ -1,5 +1,6 @@
 from mcp.server.fastmcp import FastMCP
-from market import get_share_price
+from market import get_share_price, get_share_prices, price_stats
+import json
 
 mcp = FastMCP("market_server")
 
@@ -10,6 +11,20 @@ async def lookup_share_price(symbol: str) -> float:
     """
     return get_share_price(symbol)
 
+@mcp.tool()
+async def lookup_share_prices(symbols: list[str]) -> dict[str, float | None]:
+    """
+    This tool provides the current prices of several stock symbols at once, as a mapping
+    from symbol to price. Unknown symbols map to null. Use it instead of repeated
+    lookup_share_price calls when you need more than one price.
+    """
+    prices = get_share_prices(list(dict.fromkeys(symbols)))
+    return {symbol: price or None for symbol, price in prices.items()}
+
+@mcp.resource("market://stats")
+async def read_stats_resource() -> str:
+    return json.dumps(price_stats())
+
 if __name__ == "__main__":
     mcp.run(transport='stdio')
     
\ No newline at end of file
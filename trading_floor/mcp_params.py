@@ -12,20 +12,22 @@ polygon_api_key = os.environ['POLYGON_API_KEY']
 # assume we have neither realtime nor paid Polygon.io (check workshop's GitHub for what value to use for the market_mcp variable)
 market_mcp = {"command": "uv", "args": ["run", "market_server.py"]}
 
-trader_mcp_server_params = [
-    {"command": "uv", "args": ["run", "accounts_server.py"]},
+# Servers are keyed by name: the MCP supervisor starts each key once, so servers listed under
+# the same key for every trader are shared, and per-trader ones need a key of their own
+trader_mcp_server_params = {
+    "accounts": {"command": "uv", "args": ["run", "accounts_server.py"]},
     # workshop also uses push_server.py for Push notifications
-    market_mcp,
-]
+    "market": market_mcp,
+}
 
 def researcher_mcp_server_params(name: str):
-    return [
-        {"command": "uvx", "args": ["mcp-server-fetch"]},
+    return {
+        "fetch": {"command": "uvx", "args": ["mcp-server-fetch"]},
         # I'm using Google Custom Search instead of Brave API
-        {
+        "search": {
             "command": "node",
             "args": [f"{os.getcwd()}/mcp-google-custom-search-server/build/index.js"],
             "env": search_env,
          },
-        {"command": "npx", "args": ["-y", "mcp-memory-libsql"], "env": {"LIBSQL_URL": f"file:./memory/{name}.db"}}
-    ]
\ No newline at end of file
+        f"memory-{name.lower()}": {"command": "npx", "args": ["-y", "mcp-memory-libsql"], "env": {"LIBSQL_URL": f"file:./memory/{name}.db"}}
+    }
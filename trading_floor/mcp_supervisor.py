@@ -0,0 +1,229 @@
+from agents.mcp import MCPServer, MCPServerStdio
+
+import asyncio
+import time
+from typing import Any
+
+CLIENT_SESSION_TIMEOUT = 120
+# Longest wait for a server to start, including npx/uvx package resolution on a cold cache
+STARTUP_TIMEOUT = 120.0
+HEALTH_CHECK_INTERVAL = 30.0
+PING_TIMEOUT = 10.0
+RESTART_DELAY = 1.0
+MAX_RESTART_DELAY = 60.0
+
+
+class SupervisedServer(MCPServer):
+    """
+    An MCP server process kept running across trading cycles and restarted if it crashes.
+
+    Agents use it like any other MCPServer: calls are passed on to the MCPServerStdio of the
+    process currently running, so agents can hold on to this object across restarts. The
+    process is owned by a task of its own, which enters and exits the stdio transport, as
+    anyio requires; `connect()` starts that task and waits until the server is ready.
+    """
+
+    def __init__(self, name: str, params: dict, client_session_timeout_seconds: float = CLIENT_SESSION_TIMEOUT):
+        self._name = name
+        self.params = params
+        self.client_session_timeout_seconds = client_session_timeout_seconds
+        self.server: MCPServerStdio | None = None
+        self.ready = asyncio.Event()
+        self.stopping = asyncio.Event()
+        # Set to interrupt the health check wait, when stopping or when a restart is requested
+        self.wake = asyncio.Event()
+        self.restart_requested = False
+        self.task: asyncio.Task | None = None
+        self.starts = 0
+        self.crashes = 0
+        self.restarts = 0
+        self.startup_seconds: list[float] = []
+        self.calls = 0
+        self.call_seconds = 0.0
+        self.max_call_seconds = 0.0
+        self.call_errors = 0
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    async def connect(self):
+        if self.task is None or self.task.done():
+            self.stopping.clear()
+            self.task = asyncio.create_task(self._run())
+        await self._current()
+
+    async def cleanup(self):
+        self.stopping.set()
+        self.wake.set()
+        if self.task:
+            await self.task
+
+    async def restart(self) -> None:
+        """ Replace the running process, for instance after it stopped responding to a cancelled call. """
+        self.restart_requested = True
+        self.wake.set()
+
+    async def ping(self) -> bool:
+        server = self.server
+        if server is None or server.session is None:
+            return False
+        try:
+            await asyncio.wait_for(server.session.send_ping(), PING_TIMEOUT)
+            return True
+        except Exception:
+            return False
+
+    async def _run(self) -> None:
+        failures = 0
+        while not self.stopping.is_set():
+            started = time.perf_counter()
+            try:
+                async with MCPServerStdio(self.params, cache_tools_list=True, name=self.name,
+                                          client_session_timeout_seconds=self.client_session_timeout_seconds) as server:
+                    self.startup_seconds.append(time.perf_counter() - started)
+                    self.starts += 1
+                    failures = 0
+                    self.server = server
+                    self.ready.set()
+                    reason = await self._watch()
+            except Exception as e:
+                reason = "failed"
+                print(f"MCP server {self.name} failed: {e}")
+            finally:
+                self.ready.clear()
+                self.server = None
+
+            if reason == "restart":
+                self.restarts += 1
+            elif not self.stopping.is_set():
+                self.crashes += 1
+                failures += 1
+                delay = min(RESTART_DELAY * 2 ** (failures - 1), MAX_RESTART_DELAY)
+                print(f"Restarting MCP server {self.name} in {delay:.0f}s")
+                try:
+                    await asyncio.wait_for(self.stopping.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _watch(self) -> str:
+        """ Return why the process should end: "stopping", "restart" or "unhealthy" once it stops answering pings. """
+        while True:
+            try:
+                await asyncio.wait_for(self.wake.wait(), HEALTH_CHECK_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            if self.stopping.is_set():
+                return "stopping"
+            if self.restart_requested:
+                self.restart_requested = False
+                self.wake.clear()
+                return "restart"
+            if not await self.ping():
+                print(f"MCP server {self.name} is not answering")
+                return "unhealthy"
+
+    async def _current(self) -> MCPServerStdio:
+        if self.task is None:
+            raise RuntimeError(f"MCP server {self.name} was not started")
+        await asyncio.wait_for(self.ready.wait(), STARTUP_TIMEOUT)
+        return self.server
+
+    async def list_tools(self):
+        server = await self._current()
+        return await server.list_tools()
+
+    async def read_resource(self, uri: str) -> str:
+        server = await self._current()
+        result = await asyncio.wait_for(server.session.read_resource(uri), self.client_session_timeout_seconds)
+        return result.contents[0].text
+
+    async def call_tool(self, tool_name: str, arguments: dict[str, Any] | None):
+        server = await self._current()
+        started = time.perf_counter()
+        try:
+            return await server.call_tool(tool_name, arguments)
+        except Exception:
+            self.call_errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.calls += 1
+            self.call_seconds += elapsed
+            self.max_call_seconds = max(self.max_call_seconds, elapsed)
+
+    def stats(self) -> dict:
+        return {
+            "running": self.ready.is_set(),
+            "starts": self.starts,
+            "crashes": self.crashes,
+            "restarts": self.restarts,
+            "first_startup_seconds": self.startup_seconds[0] if self.startup_seconds else None,
+            "last_startup_seconds": self.startup_seconds[-1] if self.startup_seconds else None,
+            "calls": self.calls,
+            "call_errors": self.call_errors,
+            "mean_call_seconds": self.call_seconds / self.calls if self.calls else None,
+            "max_call_seconds": self.max_call_seconds,
+        }
+
+
+class MCPSupervisor:
+    """
+    Starts the MCP servers the traders need once and keeps them warm across trading cycles.
+
+    Servers are identified by key, so a server listed for several traders under the same key
+    (market data, fetch, search) is started once and shared, while per-trader servers such as
+    each trader's memory get keys of their own.
+    """
+
+    def __init__(self, client_session_timeout_seconds: float = CLIENT_SESSION_TIMEOUT):
+        self.client_session_timeout_seconds = client_session_timeout_seconds
+        self.servers: dict[str, SupervisedServer] = {}
+
+    def servers_for(self, params_by_key: dict[str, dict]) -> list[SupervisedServer]:
+        servers = []
+        for key, params in params_by_key.items():
+            if key not in self.servers:
+                self.servers[key] = SupervisedServer(key, params, self.client_session_timeout_seconds)
+            servers.append(self.servers[key])
+        return servers
+
+    async def start(self) -> None:
+        """ Start every server registered with servers_for, concurrently. """
+        results = await asyncio.gather(*[server.connect() for server in self.servers.values()], return_exceptions=True)
+        for server, result in zip(self.servers.values(), results):
+            if isinstance(result, BaseException):
+                print(f"MCP server {server.name} did not start: {result!r}; it will keep being retried")
+
+    async def check(self, servers: list[SupervisedServer]) -> None:
+        """ Ping the given servers now and restart any that don't answer, for instance after a run was cancelled. """
+        for server, healthy in zip(servers, await asyncio.gather(*[server.ping() for server in servers])):
+            if not healthy and server.ready.is_set():
+                await server.restart()
+
+    async def read_resource(self, key: str, uri: str) -> str | None:
+        """ Read a resource from the server with the given key, or None if it isn't registered or the read fails. """
+        server = self.servers.get(key)
+        if server is None:
+            return None
+        try:
+            return await server.read_resource(uri)
+        except Exception as e:
+            print(f"Could not read {uri} from MCP server {key}: {e!r}")
+            return None
+
+    async def stop(self) -> None:
+        await asyncio.gather(*[server.cleanup() for server in self.servers.values()])
+
+    def stats(self) -> dict[str, dict]:
+        return {key: server.stats() for key, server in self.servers.items()}
+
+    def report(self) -> str:
+        """ One line per server comparing its startup time with the steady-state latency of its calls. """
+        lines = []
+        for key, stats in self.stats().items():
+            startup = f"{stats['first_startup_seconds']:.2f}s" if stats["first_startup_seconds"] is not None else "-"
+            call = f"{stats['mean_call_seconds'] * 1000:.0f}ms" if stats["mean_call_seconds"] is not None else "-"
+            lines.append(f"{key}: startup {startup}, {stats['calls']} calls averaging {call}, "
+                         f"{stats['starts']} starts, {stats['crashes']} crashes, {stats['restarts']} restarts")
+        return "\n".join(lines)
@@ -0,0 +1,200 @@
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Iterable
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing dependency for a while.
+
+    The circuit opens after `failure_threshold` consecutive failures and rejects calls
+    with CircuitOpenError. After `reset_timeout` seconds it is half-open: a single probe
+    call is let through, which closes the circuit if it succeeds and reopens it if not.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.successes = 0
+        self.failures = 0
+        self.rejected = 0
+        self.trips = 0
+
+    def call(self, fn, *args):
+        with self.lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+            if self.state == self.OPEN or (self.state == self.HALF_OPEN and self.probing):
+                self.rejected += 1
+                raise CircuitOpenError(f"circuit open after {self.consecutive_failures} failures")
+            if self.state == self.HALF_OPEN:
+                self.probing = True
+
+        try:
+            result = fn(*args)
+        except Exception:
+            with self.lock:
+                self.probing = False
+                self.failures += 1
+                self.consecutive_failures += 1
+                if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                    if self.state != self.OPEN:
+                        self.trips += 1
+                    self.state = self.OPEN
+                    self.opened_at = time.monotonic()
+            raise
+
+        with self.lock:
+            self.probing = False
+            self.successes += 1
+            self.consecutive_failures = 0
+            self.state = self.CLOSED
+        return result
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "successes": self.successes,
+                "failures": self.failures,
+                "rejected": self.rejected,
+                "trips": self.trips,
+            }
+
+
+class PriceCache:
+    """
+    Process-wide share price cache in front of a bulk price fetcher.
+
+    Prices are kept for `ttl` seconds. Symbols missing from the cache are fetched together
+    with one call to `fetch_many`, and callers asking for a symbol that is already being
+    fetched wait for that fetch instead of starting their own.
+
+    `fetch_many` takes a list of symbols and returns a dict of their prices; symbols it
+    leaves out are unknown and priced at 0.0. Any callable works, so a local stub can
+    stand in for Polygon.
+
+    Fetches go through `breaker` when one is given. When a fetch fails or the circuit is
+    open, the symbols are left out of the result, and failed symbols are not retried for
+    `negative_ttl` seconds, so callers can fall back quickly instead of waiting on timeouts.
+    """
+
+    def __init__(self, fetch_many: Callable[[list[str]], dict[str, float]], ttl: float,
+                 negative_ttl: float = 0.0, breaker: CircuitBreaker | None = None):
+        self.fetch_many = fetch_many
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.breaker = breaker
+        self.lock = threading.Lock()
+        self.prices: dict[str, tuple[float, float]] = {}
+        self.failed: dict[str, float] = {}
+        self.in_flight: dict[str, Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.negative_hits = 0
+        self.fetches = 0
+        self.fetch_failures = 0
+
+    def get(self, symbol: str) -> float | None:
+        return self.get_many([symbol]).get(symbol)
+
+    def get_many(self, symbols: Iterable[str]) -> dict[str, float]:
+        """ Return the prices of the given symbols, leaving out any that couldn't be fetched. """
+        result = {}
+        to_fetch = []
+        waiting = {}
+
+        with self.lock:
+            now = time.monotonic()
+            for symbol in dict.fromkeys(symbols):
+                cached = self.prices.get(symbol)
+                if cached and cached[1] > now:
+                    result[symbol] = cached[0]
+                    self.hits += 1
+                elif self.failed.get(symbol, 0.0) > now:
+                    self.negative_hits += 1
+                elif symbol in self.in_flight:
+                    waiting[symbol] = self.in_flight[symbol]
+                    self.coalesced += 1
+                else:
+                    self.in_flight[symbol] = Future()
+                    to_fetch.append(symbol)
+                    self.misses += 1
+
+        if to_fetch:
+            result.update(self._fetch(to_fetch))
+
+        for symbol, future in waiting.items():
+            price = future.result()
+            if price is not None:
+                result[symbol] = price
+
+        return result
+
+    def _fetch(self, symbols: list[str]) -> dict[str, float]:
+        try:
+            if self.breaker:
+                prices = self.breaker.call(self.fetch_many, symbols)
+            else:
+                prices = self.fetch_many(symbols)
+        except CircuitOpenError:
+            with self.lock:
+                for symbol in symbols:
+                    self.in_flight.pop(symbol).set_result(None)
+            return {}
+        except Exception as e:
+            print(f"Was not able to fetch prices for {', '.join(symbols)} due to {e}")
+            with self.lock:
+                self.fetches += 1
+                self.fetch_failures += 1
+                retry_at = time.monotonic() + self.negative_ttl
+                for symbol in symbols:
+                    self.failed[symbol] = retry_at
+                    self.in_flight.pop(symbol).set_result(None)
+            return {}
+
+        result = {symbol: prices.get(symbol, 0.0) for symbol in symbols}
+        with self.lock:
+            self.fetches += 1
+            expires = time.monotonic() + self.ttl
+            for symbol, price in result.items():
+                self.prices[symbol] = (price, expires)
+                self.failed.pop(symbol, None)
+                self.in_flight.pop(symbol).set_result(price)
+        return result
+
+    def clear(self) -> None:
+        with self.lock:
+            self.prices.clear()
+            self.failed.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            stats = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "negative_hits": self.negative_hits,
+                "fetches": self.fetches,
+                "fetch_failures": self.fetch_failures,
+                "cached": len(self.prices),
+            }
+        if self.breaker:
+            stats["breaker"] = self.breaker.stats()
+        return stats
@@ -0,0 +1,134 @@
+import asyncio
+import math
+import random
+import time
+from typing import Awaitable, Callable
+
+
+class Schedule:
+    """
+    One job run at wall-clock ticks every `period` seconds, shifted by `phase` seconds, so
+    its cadence doesn't drift by how long each run takes. Each run also starts up to
+    `jitter` seconds after its tick. If the previous run is still going when a tick comes,
+    the tick is skipped rather than queued.
+    """
+
+    def __init__(self, name: str, run: Callable[[], Awaitable], period: float, phase: float = 0.0, jitter: float = 0.0):
+        self.name = name
+        self.run = run
+        self.period = period
+        self.phase = phase
+        self.jitter = jitter
+        self.running: asyncio.Task | None = None
+        self.runs = 0
+        self.overruns = 0
+        self.missed_ticks = 0
+        self.idle_ticks = 0
+        self.lag_total = 0.0
+        self.max_lag = 0.0
+        self.last_duration = None
+        self.max_duration = 0.0
+
+    def next_tick(self, after: float) -> float:
+        """ The first tick strictly after the given time.time() value. """
+        return (math.floor((after - self.phase) / self.period) + 1) * self.period + self.phase
+
+    async def loop(self, until_active: Callable[[], float], max_idle_wait: float) -> None:
+        """
+        Run forever. `until_active` returns how many seconds until runs should happen, 0 meaning
+        now; while inactive, the loop sleeps in steps of at most `max_idle_wait` seconds.
+        """
+        tick = self.next_tick(time.time())
+        while True:
+            # Lag is measured from this jittered start, so the jitter itself doesn't count as lag
+            target = tick + random.uniform(0, self.jitter)
+            delay = target - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            idle = until_active()
+            if idle > 0:
+                self.idle_ticks += 1
+                tick = self.next_tick(time.time() + min(idle, max_idle_wait))
+                continue
+
+            if self.running and not self.running.done():
+                self.overruns += 1
+            else:
+                lag = time.time() - target
+                self.lag_total += lag
+                self.max_lag = max(self.max_lag, lag)
+                self.runs += 1
+                self.running = asyncio.create_task(self._timed_run())
+
+            following = self.next_tick(max(tick, time.time()))
+            self.missed_ticks += round((following - tick) / self.period) - 1
+            tick = following
+
+    async def _timed_run(self) -> None:
+        started = time.monotonic()
+        try:
+            await self.run()
+        except Exception as e:
+            print(f"Scheduled run of {self.name} failed: {e}")
+        finally:
+            self.last_duration = time.monotonic() - started
+            self.max_duration = max(self.max_duration, self.last_duration)
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "overruns": self.overruns,
+            "missed_ticks": self.missed_ticks,
+            "idle_ticks": self.idle_ticks,
+            "mean_lag_seconds": self.lag_total / self.runs if self.runs else None,
+            "max_lag_seconds": self.max_lag,
+            "last_duration_seconds": self.last_duration,
+            "max_duration_seconds": self.max_duration,
+        }
+
+
+class Scheduler:
+    """
+    Runs each job in a loop of its own, so a slow job delays nobody else. The jobs share
+    the period but their phases are spread evenly over `spread` seconds, and every run
+    adds up to `jitter` seconds, so they don't all hit the model and MCP servers at once.
+    """
+
+    def __init__(self, period: float, spread: float = 0.0, jitter: float = 0.0,
+                 until_active: Callable[[], float] = lambda: 0.0, max_idle_wait: float = 3600.0):
+        self.period = period
+        self.spread = spread
+        self.jitter = jitter
+        self.until_active = until_active
+        self.max_idle_wait = max_idle_wait
+        self.schedules: list[Schedule] = []
+        self.tasks: list[asyncio.Task] = []
+
+    def add(self, name: str, run: Callable[[], Awaitable]) -> None:
+        self.schedules.append(Schedule(name, run, self.period, jitter=self.jitter))
+
+    def start(self) -> None:
+        for i, schedule in enumerate(self.schedules):
+            schedule.phase = i * self.spread / len(self.schedules)
+            self.tasks.append(asyncio.create_task(schedule.loop(self.until_active, self.max_idle_wait)))
+
+    async def stop(self) -> None:
+        tasks = self.tasks + [schedule.running for schedule in self.schedules if schedule.running]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.tasks = []
+
+    def stats(self) -> dict[str, dict]:
+        return {schedule.name: schedule.stats() for schedule in self.schedules}
+
+    def report(self) -> str:
+        """ One line per job with its runs, schedule lag and overruns. """
+        lines = []
+        for name, stats in self.stats().items():
+            lag = f"{stats['mean_lag_seconds']:.1f}s" if stats["mean_lag_seconds"] is not None else "-"
+            lines.append(f"{name}: {stats['runs']} runs, mean lag {lag} (max {stats['max_lag_seconds']:.1f}s), "
+                         f"{stats['overruns']} overruns, {stats['missed_ticks']} missed ticks, "
+                         f"longest run {stats['max_duration_seconds']:.0f}s")
+        return "\n".join(lines)
@@ -0,0 +1,63 @@
+import struct
+
+# Symbols are stored as fixed-width, NUL-padded ASCII so the i-th one is at a known offset
+SYMBOL_WIDTH = 16
+PRICE = struct.Struct("<d")
+
+
+class Snapshot:
+    """
+    Closing prices for a whole market on one day, in columnar form.
+
+    `symbols` is a sorted array of fixed-width symbols and `prices` the matching array of
+    little-endian float64 prices. A lookup is a binary search directly over these bytes,
+    so a snapshot read from the database can answer queries without decoding every entry.
+    """
+
+    def __init__(self, symbols: bytes, prices: bytes):
+        self.symbols = symbols
+        self.prices = prices
+        self.count = len(prices) // PRICE.size
+
+    @classmethod
+    def from_dict(cls, prices: dict[str, float]) -> "Snapshot":
+        keys = sorted(
+            (symbol.encode("ascii").ljust(SYMBOL_WIDTH, b"\0"), price)
+            for symbol, price in prices.items()
+            if symbol.isascii() and len(symbol) <= SYMBOL_WIDTH
+        )
+        symbols = b"".join(key for key, _ in keys)
+        packed = struct.pack(f"<{len(keys)}d", *(price for _, price in keys))
+        return cls(symbols, packed)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _symbol_at(self, i: int) -> bytes:
+        return self.symbols[i * SYMBOL_WIDTH:(i + 1) * SYMBOL_WIDTH]
+
+    def _find(self, symbol: str) -> int:
+        if not symbol.isascii() or len(symbol) > SYMBOL_WIDTH:
+            return -1
+        key = symbol.encode("ascii").ljust(SYMBOL_WIDTH, b"\0")
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._symbol_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < self.count and self._symbol_at(lo) == key else -1
+
+    def get(self, symbol: str, default: float = 0.0) -> float:
+        i = self._find(symbol)
+        return PRICE.unpack_from(self.prices, i * PRICE.size)[0] if i >= 0 else default
+
+    def __contains__(self, symbol: str) -> bool:
+        return self._find(symbol) >= 0
+
+    def to_dict(self) -> dict[str, float]:
+        return {
+            self._symbol_at(i).rstrip(b"\0").decode("ascii"): PRICE.unpack_from(self.prices, i * PRICE.size)[0]
+            for i in range(self.count)
+        }
@@ -1,7 +1,8 @@
 from datetime import datetime
 
 # assume we have neither realtime nor paid Polygon.io (check workshop's GitHub for what value to use for the note variable)
-note = "You have access to end of day market data; use you get_share_price tool to get the share price as of the prior close."
+note = "You have access to end of day market data; use your lookup_share_price tool to get the share price as of the prior close, \
+or lookup_share_prices to get the prices of several symbols in one call."
 
 
 def researcher_instructions():
@@ -33,7 +34,7 @@ You are {name}, a trader on the stock market. Your account is under your name, {
 You actively manage your portfolio according to your strategy.
 You have access to tools including a researcher to research online for news and opportunities, based on your request.
 You also have tools to access to financial data for stocks. {note}
-And you have tools to buy and sell stocks using your account name {name}.
+And you have tools to buy and sell stocks using your account name {name}; to make several trades, place them together in one execute_orders call.
 You can use your entity tools as a persistent memory to store and recall information; you share
 this memory with other traders and can benefit from the group's knowledge.
 Use these tools to carry out research, make decisions, and execute trades.
@@ -1,8 +1,38 @@
 from agents import TracingProcessor, Trace, Span
-from database import write_log
+from database import write_log, flush_logs, write_span, flush_spans, read_span_breakdown, BatchWriter
 
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+import hashlib
+import json
+import os
+import random
 import secrets
 import string
+import threading
+import time
+
+load_dotenv(override=True)
+
+# Fraction of traces whose entries LogTracer writes as they happen
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '1.0'))
+# Span types LogTracer writes, comma separated (e.g. "agent,function"); empty for all
+LOG_SPAN_TYPES = {type_.strip() for type_ in os.getenv('LOG_SPAN_TYPES', '').split(',') if type_.strip()}
+# Traces that weren't sampled are still written if they take at least this long
+LOG_SLOW_TRACE_SECONDS = float(os.getenv('LOG_SLOW_TRACE_SECONDS', '300'))
+# Most entries held in memory for a trace that wasn't sampled
+LOG_HELD_ENTRIES = 1_000
+
+# Directory for OTLPFileExporter files; the floor only exports traces when it is set
+TRACE_EXPORT_DIR = os.getenv('TRACE_EXPORT_DIR')
+# A batch is written once this many spans are queued, or this long after the first of them was
+TRACE_EXPORT_BATCH_SIZE = 200
+TRACE_EXPORT_INTERVAL = 10.0
+# Spans waiting to be written beyond this many are dropped rather than stalling the traced code
+TRACE_EXPORT_QUEUE_SIZE = 10_000
+# Files are rotated at this size, and only the most recent ones are kept
+TRACE_FILE_MAX_BYTES = 10_000_000
+TRACE_FILES_KEPT = 20
 
 ALPHANUM = string.ascii_lowercase + string.digits
 
@@ -16,67 +46,303 @@ def make_trace_id(tag: str) -> str:
     random_suffix = ''.join(secrets.choice(ALPHANUM) for _ in range(pad_len))
     return f'trace_{tag}{random_suffix}'
 
+def get_trader_name(trace_or_span: Trace | Span) -> str | None:
+    """ Recover the tag passed to make_trace_id, or None for traces not made by it. """
+    name = trace_or_span.trace_id.split('_')[1]
+
+    if '0' in name:
+        return name.split('0')[0]
+    else:
+        return None
+
+def get_span_name_and_server(span: Span) -> tuple[str | None, str | None]:
+    """ The tool, agent or model name of a span, and the MCP server it went to, if any. """
+    data = span.span_data
+    name = getattr(data, 'name', None) or getattr(data, 'model', None)
+    server = getattr(data, 'server', None) or (getattr(data, 'mcp_data', None) or {}).get('server')
+    return name, server
+
 class LogTracer(TracingProcessor):
+    """
+    Writes trace and span starts and ends to the logs shown in the dashboard.
+
+    How much gets written is tunable: a `sample_rate` fraction of traces is logged as it
+    happens (head sampling), and only spans whose type is in `span_types` are logged, or
+    all types if it is empty. Spans that fail are always logged. Entries of traces that
+    weren't sampled are held in memory until the trace ends, and written only if the trace
+    had a failing span or took at least `slow_trace_seconds` (tail-based retention).
+    """
+
+    def __init__(self, sample_rate: float = LOG_SAMPLE_RATE, span_types: set[str] | None = None,
+                 slow_trace_seconds: float = LOG_SLOW_TRACE_SECONDS):
+        self.sample_rate = sample_rate
+        self.span_types = LOG_SPAN_TYPES if span_types is None else span_types
+        self.slow_trace_seconds = slow_trace_seconds
+        self.lock = threading.Lock()
+        # Traces in progress by id: when they started, whether sampled, held entries and whether a span failed
+        self.traces: dict[str, dict] = {}
+        self.sampled = 0
+        self.retained = 0
+        self.dropped = 0
+
     def get_name(self, trace_or_span: Trace | Span) -> str | None:
-        name = trace_or_span.trace_id.split('_')[1]
-        
-        if '0' in name:
-            return name.split('0')[0]
-        else:
-            return None
-    
+        return get_trader_name(trace_or_span)
+
+    def write(self, trace_id: str, name: str, type_: str, message: str) -> None:
+        # write_log blocks while the log queue is full, so it is called after releasing the lock
+        with self.lock:
+            state = self.traces.get(trace_id)
+            if state is not None and not state["sampled"]:
+                if len(state["held"]) < LOG_HELD_ENTRIES:
+                    state["held"].append((name, type_, message))
+                return
+        write_log(name, type_, message)
+
     def on_trace_start(self, trace) -> None:
         name = self.get_name(trace)
         if name:
-            write_log(name, 'trace', f'Started: {trace.name}')
-    
+            sampled = random.random() < self.sample_rate
+            with self.lock:
+                self.traces[trace.trace_id] = {"started": time.monotonic(), "sampled": sampled, "held": [], "failed": False}
+            self.write(trace.trace_id, name, 'trace', f'Started: {trace.name}')
+
     def on_trace_end(self, trace) -> None:
         name = self.get_name(trace)
         if name:
+            held = []
+            with self.lock:
+                state = self.traces.pop(trace.trace_id, None)
+                if state and not state["sampled"]:
+                    if not state["failed"] and time.monotonic() - state["started"] < self.slow_trace_seconds:
+                        self.dropped += 1
+                        return
+                    self.retained += 1
+                    held = state["held"]
+                elif state:
+                    self.sampled += 1
+            for entry in held:
+                write_log(*entry)
             write_log(name, 'trace', f'Ended: {trace.name}')
-    
+
+    def describe(self, span, verb: str) -> str:
+        message = verb
+
+        if span.span_data:
+            if span.span_data.type:
+                message += f' {span.span_data.type}'
+            if hasattr(span.span_data, 'name') and span.span_data.name:
+                message += f' {span.span_data.name}'
+            if hasattr(span.span_data, 'server') and span.span_data.server:
+                message += f' {span.span_data.server}'
+
+        if span.error:
+            message += f' {span.error}'
+
+        return message
+
     def on_span_start(self, span) -> None:
         name = self.get_name(span)
         type_ = span.span_data.type if span.span_data else 'span'
 
-        if name:
-            message = 'Started'
-
-            if span.span_data:
-                if span.span_data.type:
-                    message += f' {span.span_data.type}'
-                if hasattr(span.span_data, 'name') and span.span_data.name:
-                    message += f' {span.span_data.name}'
-                if hasattr(span.span_data, 'server') and span.span_data.server:
-                    message += f' {span.span_data.server}'
-            
-            if span.error:
-                message += f' {span.error}'
-            
-            write_log(name, type_, message)
-    
+        if name and (not self.span_types or type_ in self.span_types):
+            self.write(span.trace_id, name, type_, self.describe(span, 'Started'))
+
     def on_span_end(self, span) -> None:
         name = self.get_name(span)
         type_ = span.span_data.type if span.span_data else 'span'
 
-        if name:
-            message = 'Ended'
-
-            if span.span_data:
-                if span.span_data.type:
-                    message += f' {span.span_data.type}'
-                if hasattr(span.span_data, 'name') and span.span_data.name:
-                    message += f' {span.span_data.name}'
-                if hasattr(span.span_data, 'server') and span.span_data.server:
-                    message += f' {span.span_data.server}'
-            
-            if span.error:
-                message += f' {span.error}'
-            
-            write_log(name, type_, message)
-    
+        if name and span.error:
+            with self.lock:
+                if span.trace_id in self.traces:
+                    self.traces[span.trace_id]["failed"] = True
+        if name and (not self.span_types or type_ in self.span_types or span.error):
+            self.write(span.trace_id, name, type_, self.describe(span, 'Ended'))
+
+    def stats(self) -> dict[str, int]:
+        """ How many finished traces were logged as sampled, retained at the end, or dropped. """
+        with self.lock:
+            return {"sampled": self.sampled, "retained": self.retained, "dropped": self.dropped, "in_progress": len(self.traces)}
+
     def force_flush(self) -> None:
+        flush_logs()
+
+    def shutdown(self) -> None:
+        flush_logs()
+
+
+class SpanTracer(TracingProcessor):
+    """
+    Stores every finished span in the spans table with its ids, timing and error, so the
+    time a trader's run takes can be broken down with queries instead of parsing log text.
+    Rows are queued and committed in batches by the database's background writer.
+    """
+
+    def on_trace_start(self, trace) -> None:
+        pass
+
+    def on_trace_end(self, trace) -> None:
+        pass
+
+    def on_span_start(self, span) -> None:
         pass
-    
+
+    def on_span_end(self, span) -> None:
+        if not span.started_at or not span.ended_at:
+            return
+        data = span.span_data
+        name, server = get_span_name_and_server(span)
+        duration = (datetime.fromisoformat(span.ended_at) - datetime.fromisoformat(span.started_at)).total_seconds()
+        error = span.error['message'] if span.error else None
+        write_span(span.span_id, span.trace_id, span.parent_id, get_trader_name(span), data.type if data else 'span',
+                   name, server, span.started_at, span.ended_at, duration, error)
+
+    def force_flush(self) -> None:
+        flush_spans()
+
     def shutdown(self) -> None:
+        flush_spans()
+
+
+class OTLPFileExporter(TracingProcessor):
+    """
+    Buffers finished traces and spans and appends them in batches to local files as OTLP-JSON,
+    one ExportTraceServiceRequest per line (the layout of the OpenTelemetry collector's file
+    exporter), so a trading cycle can be loaded into Jaeger, Perfetto or another trace viewer.
+
+    Each trace is exported as a root span that its top-level spans hang off. Agents SDK ids
+    aren't hex, so OTLP ids are derived from them by hashing; the originals are kept as
+    attributes. Files rotate at `max_bytes` and only the newest `files_kept` are kept.
+
+    Spans are queued on a BatchWriter, whose thread writes them, so no file I/O happens in the
+    tracing callbacks and a partial batch is written after `interval` even when no more spans come.
+    """
+
+    def __init__(self, directory: str, batch_size: int = TRACE_EXPORT_BATCH_SIZE,
+                 interval: float = TRACE_EXPORT_INTERVAL, max_bytes: int = TRACE_FILE_MAX_BYTES, files_kept: int = TRACE_FILES_KEPT,
+                 max_queued: int = TRACE_EXPORT_QUEUE_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.files_kept = files_kept
+        self.lock = threading.Lock()
+        self.trace_starts: dict[str, str] = {}
+        self.writer = BatchWriter("trace export", self.write, flush_interval=interval, batch_size=batch_size, max_queued=max_queued)
+        self.path = None
+        self.rotations = 0
+        self.exported = 0
+        self.dropped = 0
+
+    @staticmethod
+    def otlp_id(agents_id: str, hex_digits: int) -> str:
+        return hashlib.sha256(agents_id.encode()).hexdigest()[:hex_digits]
+
+    @staticmethod
+    def unix_nanos(iso: str) -> str:
+        return str(int(datetime.fromisoformat(iso).timestamp() * 1_000_000_000))
+
+    def to_otlp(self, trace_id: str, span_id: str, parent_id: str | None, name: str, start: str, end: str,
+                attributes: dict, error: dict | None) -> dict:
+        span = {
+            "traceId": self.otlp_id(trace_id, 32),
+            "spanId": self.otlp_id(span_id, 16),
+            "name": name,
+            "kind": 1,
+            "startTimeUnixNano": self.unix_nanos(start),
+            "endTimeUnixNano": self.unix_nanos(end),
+            "attributes": [{"key": key, "value": {"stringValue": str(value)}} for key, value in attributes.items() if value is not None],
+            "status": {"code": 2, "message": error["message"]} if error else {"code": 0},
+        }
+        # Top-level spans are children of the span standing for the trace itself
+        span["parentSpanId"] = self.otlp_id(parent_id or trace_id, 16) if span_id != trace_id else ""
+        return span
+
+    def on_trace_start(self, trace) -> None:
+        with self.lock:
+            self.trace_starts[trace.trace_id] = datetime.now(timezone.utc).isoformat()
+
+    def on_trace_end(self, trace) -> None:
+        with self.lock:
+            start = self.trace_starts.pop(trace.trace_id, None)
+        if start:
+            attributes = {"agents.trace_id": trace.trace_id, "trader": get_trader_name(trace)}
+            self.add(self.to_otlp(trace.trace_id, trace.trace_id, None, trace.name, start,
+                                  datetime.now(timezone.utc).isoformat(), attributes, None))
+
+    def on_span_start(self, span) -> None:
         pass
+
+    def on_span_end(self, span) -> None:
+        if not span.started_at or not span.ended_at:
+            return
+        data = span.span_data
+        type_ = data.type if data else 'span'
+        name, server = get_span_name_and_server(span)
+        attributes = {
+            "agents.span_id": span.span_id,
+            "agents.span_type": type_,
+            "trader": get_trader_name(span),
+            "mcp.server": server,
+        }
+        self.add(self.to_otlp(span.trace_id, span.span_id, span.parent_id, f"{type_} {name}" if name else type_,
+                              span.started_at, span.ended_at, attributes, span.error))
+
+    def add(self, otlp_span: dict) -> None:
+        if not self.writer.offer(otlp_span):
+            with self.lock:
+                self.dropped += 1
+
+    def write(self, batch: list[dict]) -> None:
+        """ Append one batch as a line of the current file, rotating first if it is full. Called by the writer's thread. """
+        request = {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "trading_floor"}}]},
+                "scopeSpans": [{"scope": {"name": "openai-agents"}, "spans": batch}],
+            }]
+        }
+        os.makedirs(self.directory, exist_ok=True)
+        if self.path is None or not os.path.exists(self.path) or os.path.getsize(self.path) >= self.max_bytes:
+            self.rotate()
+        with open(self.path, "a") as f:
+            f.write(json.dumps(request, separators=(",", ":")) + "\n")
+        self.exported += len(batch)
+
+    def rotate(self) -> None:
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+        self.rotations += 1
+        self.path = os.path.join(self.directory, f"traces-{stamp}-{os.getpid()}-{self.rotations:04d}.jsonl")
+        files = sorted(f for f in os.listdir(self.directory) if f.startswith("traces-") and f.endswith(".jsonl"))
+        for old in files[:max(0, len(files) + 1 - self.files_kept)]:
+            os.remove(os.path.join(self.directory, old))
+
+    def force_flush(self) -> None:
+        """ Block until every span queued so far has been written. """
+        self.writer.flush()
+
+    def shutdown(self) -> None:
+        self.force_flush()
+
+
+def latency_breakdown(trader: str, since: str | None = None) -> dict[str, dict]:
+    """
+    Where a trader's runs spent their time, in three groups: "generation" by model (LLM calls),
+    "tool" by tool name and "mcp_server" by server, covering its tool calls and tool listings.
+    Each entry has the count, total, mean and max seconds and the number of errors.
+    """
+    breakdown = {"generation": {}, "tool": {}, "mcp_server": {}}
+    for row in read_span_breakdown(trader, since):
+        groups = []
+        if row["type"] == "generation":
+            groups.append(("generation", row["name"]))
+        elif row["type"] == "function":
+            groups.append(("tool", row["name"]))
+        if row["server"]:
+            groups.append(("mcp_server", row["server"]))
+        for group, key in groups:
+            entry = breakdown[group].setdefault(key, {"count": 0, "total": 0.0, "max": 0.0, "errors": 0})
+            entry["count"] += row["count"]
+            entry["total"] += row["total"]
+            entry["max"] = max(entry["max"], row["max"])
+            entry["errors"] += row["errors"]
+    for entries in breakdown.values():
+        for entry in entries.values():
+            entry["mean"] = entry["total"] / entry["count"]
+    return breakdown
@@ -1,15 +1,18 @@
-from agents import Agent, Tool, Runner, OpenAIChatCompletionsModel, trace, AsyncOpenAI
+from agents import Agent, Runner, RunHooks, OpenAIChatCompletionsModel, trace, AsyncOpenAI
 from agents.mcp import MCPServerStdio
 
 from contextlib import AsyncExitStack
 from dotenv import load_dotenv
+import asyncio
 import os
-import json
+import time
 
-from accounts_client import read_accounts_resource, read_strategy_resource
+from accounts_client import read_summary_resource, read_strategy_resource
+from database import write_log
 from tracers import make_trace_id
 from templates import researcher_instructions, trader_instructions, trade_message, rebalance_message, research_tool
 from mcp_params import trader_mcp_server_params, researcher_mcp_server_params
+from mcp_supervisor import MCPSupervisor
 
 load_dotenv(override=True)
 
@@ -18,6 +21,9 @@ google_api_key = os.environ['GOOGLE_API_KEY']
 GEMINI_BASE_URL = os.environ['GEMINI_BASE_URL']
 
 MAX_TURNS = 30
+# A run is cancelled once it takes longer than this, and every MCP tool call once it takes longer than that
+RUN_TIMEOUT_SECONDS = float(os.getenv('RUN_TIMEOUT_SECONDS', '600'))
+TOOL_TIMEOUT_SECONDS = float(os.getenv('TOOL_TIMEOUT_SECONDS', '60'))
 
 gemini_client = AsyncOpenAI(base_url=GEMINI_BASE_URL, api_key=gemini_api_key)
 
@@ -27,26 +33,60 @@ def get_model(model_name: str):
 async def get_researcher(mcp_servers, model_name) -> Agent:
     return Agent(
         name='Researcher',
-        instructions=researcher_instructions(),
+        # Rendered for each run, as they include the current datetime
+        instructions=lambda context, agent: researcher_instructions(),
         model=get_model(model_name),
         mcp_servers=mcp_servers
     )
 
-async def get_researcher_tool(mcp_servers, model_name) -> Tool:
-    researcher = await get_researcher(mcp_servers, model_name)
-    return researcher.as_tool(tool_name='Researcher', tool_description=research_tool())
+class RunProgress(RunHooks):
+    """ Follows the tool calls of a run, so a run that gets cancelled can log how far it got. """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.completed: list[str] = []
+        self.in_flight: list[str] = []
+
+    async def on_tool_start(self, context, agent, tool):
+        self.in_flight.append(tool.name)
+
+    async def on_tool_end(self, context, agent, tool, result):
+        self.in_flight.remove(tool.name)
+        self.completed.append(tool.name)
+
+    def summary(self) -> str:
+        done = f"{len(self.completed)} tool calls completed" + (f" ({', '.join(self.completed)})" if self.completed else "")
+        waiting = f", waiting on {', '.join(self.in_flight)}" if self.in_flight else ""
+        return f"{done}{waiting}"
+
 
 class Trader:
-    def __init__(self, name: str, lastname='Trader', model_name='gemini-2.5-flash'):
+    def __init__(self, name: str, lastname='Trader', model_name='gemini-2.5-flash', supervisor: MCPSupervisor | None = None):
         self.name = name
         self.lastname = lastname
         self.agent = None
+        self.researcher = None
         self.model_name = model_name
+        # Seconds spent in each step of the last run
+        self.timings: dict[str, float] = {}
         self.do_trade = True
+        self.progress = RunProgress()
+        # With a supervisor the MCP servers stay up between runs; without one each run starts its own
+        self.supervisor = supervisor
+        if supervisor:
+            self.trader_mcp_servers = supervisor.servers_for(trader_mcp_server_params)
+            self.researcher_mcp_servers = supervisor.servers_for(researcher_mcp_server_params(name))
     
     async def create_agent(self, trader_mcp_servers, researcher_mcp_servers) -> Agent:
-        tool = await get_researcher_tool(researcher_mcp_servers, self.model_name)
-        
+        """ Build the trader and researcher agents on the first run; later runs only rebind their MCP servers. """
+        if self.agent is not None:
+            self.agent.mcp_servers = trader_mcp_servers
+            self.researcher.mcp_servers = researcher_mcp_servers
+            return self.agent
+
+        self.researcher = await get_researcher(researcher_mcp_servers, self.model_name)
+        tool = self.researcher.as_tool(tool_name='Researcher', tool_description=research_tool())
+
         self.agent = Agent(
             name=self.name,
             instructions=trader_instructions(self.name),
@@ -54,30 +94,41 @@ class Trader:
             tools=[tool],
             mcp_servers=trader_mcp_servers,
         )
-        
+
         return self.agent
     
     async def get_account_report(self) -> str:
-        account = await read_accounts_resource(self.name)
-        account_json = json.loads(account)
-        account_json.pop('portfolio_value_time_series', None)
-        return json.dumps(account_json)
+        """ The compact account summary, which stays the same size however long the account has traded. """
+        return await read_summary_resource(self.name)
     
     async def run_agent(self, trader_mcp_servers, researcher_mcp_servers):
+        timings = {}
+        started = time.perf_counter()
+        step = 'rebind_agent' if self.agent else 'build_agent'
         self.agent = await self.create_agent(trader_mcp_servers, researcher_mcp_servers)
-        
-        account = await self.get_account_report()
-        strategy = await read_strategy_resource(self.name)
-        
+        timings[step] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        account, strategy = await asyncio.gather(self.get_account_report(), read_strategy_resource(self.name))
+        timings['account_and_strategy'] = time.perf_counter() - started
+
         message = trade_message(self.name, strategy, account) if self.do_trade else rebalance_message(self.name, strategy, account)
 
-        await Runner.run(self.agent, message, max_turns=MAX_TURNS)
+        started = time.perf_counter()
+        await Runner.run(self.agent, message, max_turns=MAX_TURNS, hooks=self.progress)
+        timings['agent_run'] = time.perf_counter() - started
+
+        self.timings = timings
+        print(f'Trader "{self.name}" run: ' + ', '.join(f'{step} {seconds:.3f}s' for step, seconds in timings.items()))
     
     async def run_with_mcp_servers(self):
+        if self.supervisor:
+            await self.run_agent(self.trader_mcp_servers, self.researcher_mcp_servers)
+            return
         async with AsyncExitStack() as stack:
-            trader_mcp_servers = [await stack.enter_async_context(MCPServerStdio(params, client_session_timeout_seconds=120)) for params in trader_mcp_server_params]
+            trader_mcp_servers = [await stack.enter_async_context(MCPServerStdio(params, client_session_timeout_seconds=TOOL_TIMEOUT_SECONDS)) for params in trader_mcp_server_params.values()]
             async with AsyncExitStack() as stack:
-                researcher_mcp_servers = [await stack.enter_async_context(MCPServerStdio(params, client_session_timeout_seconds=120)) for params in researcher_mcp_server_params(self.name)]
+                researcher_mcp_servers = [await stack.enter_async_context(MCPServerStdio(params, client_session_timeout_seconds=TOOL_TIMEOUT_SECONDS)) for params in researcher_mcp_server_params(self.name).values()]
                 await self.run_agent(trader_mcp_servers, researcher_mcp_servers)
     
     async def run_with_trace(self):
@@ -88,8 +139,22 @@ class Trader:
             await self.run_with_mcp_servers()
     
     async def run(self):
+        self.progress = RunProgress()
+        deadline = asyncio.timeout(RUN_TIMEOUT_SECONDS)
         try:
-            await self.run_with_trace()
+            async with deadline:
+                await self.run_with_trace()
+        except TimeoutError as e:
+            if not deadline.expired():
+                print(f'Error running Trader "{self.name}": {e!r}')
+            else:
+                # Unsupervised MCP servers were shut down as the cancellation unwound; supervised ones
+                # are shared, so only those that stopped answering are restarted
+                message = f'Run cancelled after {RUN_TIMEOUT_SECONDS:.0f}s: {self.progress.summary()}'
+                print(f'Trader "{self.name}": {message}')
+                write_log(self.name.lower(), 'trace', message)
+                if self.supervisor:
+                    await self.supervisor.check(self.trader_mcp_servers + self.researcher_mcp_servers)
         except Exception as e:
             print(f'Error running Trader "{self.name}": {e}')
         self.do_trade = not self.do_trade
\ No newline at end of file
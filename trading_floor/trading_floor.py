@@ -1,8 +1,11 @@
 from agents import add_trace_processor
 
-from tracers import LogTracer
-from market import is_market_open
-from traders import Trader
+from tracers import LogTracer, SpanTracer, OTLPFileExporter, TRACE_EXPORT_DIR
+from market import is_market_open, polygon_api_key
+from market_calendar import MarketCalendar
+from mcp_supervisor import MCPSupervisor
+from scheduler import Scheduler
+from traders import Trader, TOOL_TIMEOUT_SECONDS
 
 from typing import List
 import asyncio
@@ -13,6 +16,11 @@ load_dotenv(override=True)
 
 RUN_EVERY_N_MINUTES = 1
 RUN_EVEN_WHEN_MARKET_IS_CLOSED = os.getenv('RUN_EVEN_WHEN_MARKET_IS_CLOSED', 'false').strip().lower() == 'true'
+# The calendar decides whether the market is open; the Polygon market status is only checked this often to catch unscheduled closures
+RECONCILE_EVERY_N_MINUTES = 60
+# Each trader runs on its own wall-clock ticks; their start times are spread over this many seconds, plus random jitter
+SCHEDULE_SPREAD_SECONDS = 20
+SCHEDULE_JITTER_SECONDS = 5
 
 names = ['Warren', 'George', 'Ray', "Cathie"]
 lastnames = ['Patience', 'Bold', 'Systematic', 'Crypto']
@@ -20,23 +28,46 @@ lastnames = ['Patience', 'Bold', 'Systematic', 'Crypto']
 model_names = ['gemini-2.5-flash-lite']*4
 short_model_names = ['Gemini 2.5 Flash']*4
 
-def create_traders() -> List[Trader]:
+def create_traders(supervisor: MCPSupervisor | None = None) -> List[Trader]:
     traders = []
     for name, lastname, model_name in zip(names, lastnames, model_names):
-        traders.append(Trader(name, lastname, model_name))
+        traders.append(Trader(name, lastname, model_name, supervisor))
     return traders
 
 async def run_every_n_mins():
     add_trace_processor(LogTracer())
-    traders = create_traders()
+    add_trace_processor(SpanTracer())
+    if TRACE_EXPORT_DIR:
+        add_trace_processor(OTLPFileExporter(TRACE_EXPORT_DIR))
+    supervisor = MCPSupervisor(TOOL_TIMEOUT_SECONDS)
+    traders = create_traders(supervisor)
+    await supervisor.start()
+    print(f'MCP servers started:\n{supervisor.report()}')
+    calendar = MarketCalendar()
+
+    def until_open() -> float:
+        if RUN_EVEN_WHEN_MARKET_IS_CLOSED or calendar.is_open():
+            return 0.0
+        return calendar.seconds_until_open() or RUN_EVERY_N_MINUTES*60
+
+    # Wake up at least once per reconciliation while the market is closed, in case it changes the calendar's answer
+    scheduler = Scheduler(RUN_EVERY_N_MINUTES*60, SCHEDULE_SPREAD_SECONDS, SCHEDULE_JITTER_SECONDS,
+                          until_active=until_open, max_idle_wait=RECONCILE_EVERY_N_MINUTES*60)
+    for trader in traders:
+        scheduler.add(trader.name, trader.run)
+    scheduler.start()
 
     while True:
-        if RUN_EVEN_WHEN_MARKET_IS_CLOSED or is_market_open():
-            await asyncio.gather(*[trader.run() for trader in traders])
-        else:
-            print('Market is closed, skipping run')
-        
-        await asyncio.sleep(RUN_EVERY_N_MINUTES*60)
+        if polygon_api_key:
+            await asyncio.to_thread(calendar.reconcile, is_market_open, RECONCILE_EVERY_N_MINUTES*60)
+        if not (RUN_EVEN_WHEN_MARKET_IS_CLOSED or calendar.is_open()):
+            print(f'Market is closed, next open at {calendar.next_open():%Y-%m-%d %H:%M %Z}')
+        await asyncio.sleep(RECONCILE_EVERY_N_MINUTES*60)
+        print(f'Schedule:\n{scheduler.report()}')
+        print(f'MCP servers:\n{supervisor.report()}')
+        # Price cache, circuit breaker and Polygon client counters live in the market server process
+        print(f'Market server prices: {await supervisor.read_resource("market", "market://stats")}')
+        print(f'Accounts server cache: {await supervisor.read_resource("accounts", "accounts://stats")}')
 
 if __name__ == "__main__":
     print(f'Starting scheduler to run every {RUN_EVERY_N_MINUTES} mins')